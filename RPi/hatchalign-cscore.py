@@ -1,48 +1,67 @@
 #!/usr/bin/env python3
 
 # import necessary libraries
+import argparse
 import numpy as np
-import cscore as cs
 import cv2
-import imutils
-import json
 import logging
+import os
+import sys
 import time
-import wpilib
 
-from cscore import CameraServer, VideoSource, UsbCamera, MjpegServer
+from cscore import CameraServer
 from networktables import NetworkTables
-from networktables import NetworkTablesInstance
-from scipy.interpolate import interp1d
+
+# make the shared hatchvision package importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from hatchvision import chain, detect
+from hatchvision.bounds import BoundsCache
+from hatchvision.chain import VisionChain
+from hatchvision.publish import OffsetPublisher
+from hatchvision.source import open_source
 
 def main():
+    # parse arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-j", "--config", default=chain.config_path(__file__), help="vision chain config")
+    ap.add_argument("-e", "--detector", choices=sorted(detect.DETECTORS), help="detection backend")
+    args = vars(ap.parse_args())
+
+    # the vision chain is declared in the config, the detector option wins over it
+    try:
+        vision = chain.override(chain.load(args["config"]), backend=args["detector"])
+        chain.stages(vision)
+    except (IOError, KeyError, ValueError) as e:
+        ap.error("{}: {}".format(args["config"], e))
+
     # setup up logging
     logging.basicConfig(level=logging.DEBUG)
 
     # connect to the roborio network tables
     NetworkTables.initialize(server="192.168.1.106")
 
-    # get the table
+    # get the table and keep the bounds from it cached
     sd = NetworkTables.getTable("SmartDashboard")
+    cache = BoundsCache(sd)
+    publisher = OffsetPublisher(sd, NetworkTables.flush)
 
     # initialize some variables
-    width = 640
-    height = 480
-    min_area = 100
-    centerX = width // 2
-    distance_between_targets = 11.5
+    width = vision["width"]
+    height = vision["height"]
+    vision = VisionChain(vision, (width, height))
+    centerX = vision.centerX
     lX = lY = rX = rY = 0
 
-    # set up the camera
+    # set up the camera, the video mode is set on the camera itself, and wait
+    # for its first frame
     camServer = CameraServer.getInstance()
-    camera = cs.UsbCamera("rPi Camera 0", 0)
-    camera.setVideoMode(cs.VideoMode.PixelFormat.kMJPEG, width, height, 30)
+    source = open_source("cscore:0", width, height, 30)
+    if not source.first(5.0):
+        sys.exit("No frames from the camera")
 
     # mjpegServer = cs.MjpegServer("httpserver", 8081)
-    # mjpegServer.setSource(camera)
-
-    cvsink = cs.CvSink("cvsink")
-    cvsink.setSource(camera)
+    # mjpegServer.setSource(source.camera)
 
     # cvSource = cs.CvSource("cvsource", cs.VideoMode.PixelFormat.kMJPEG, width, height, 30)
     # cvMjpegServer = cs.MjpegServer("cvhttpserver", 8082)
@@ -50,93 +69,39 @@ def main():
 
     outputStream = camServer.putVideo("Mask", width, height)
 
-    # initialize frame holders to save time
+    # initialize frame holders to save time, the chain keeps its own
     frame   = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-    blurred = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-    hsv     = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-    mask    = np.zeros(shape=(height, width, 3), dtype=np.uint8)
 
     count = 0
 
     while True:
-        time, frame = cvsink.grabFrame(frame)
-        if time == 0:
+        # the newest frame into the same buffer, None on a camera error
+        captured, result = source.read(frame)
+        if result is None:
             continue
 
-        # blur frame and convert it to hsv color space
-        blurred = cv2.GaussianBlur(frame, (11, 11), 0)
-        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
-
-        # get the bounds from the dashboard
-        lH = sd.getNumber("H-Lower", 0)
-        uH = sd.getNumber("H-Upper", 180)
-
-        lS = sd.getNumber("S-Lower", 0)
-        uS = sd.getNumber("S-Upper", 255)
-
-        lV = sd.getNumber("V-Lower", 0)
-        uV = sd.getNumber("V-Upper", 255)
-
-        # construct a mask for the bounds then erode and dilate it
-        mask = cv2.inRange(hsv, (lH, lS, lV), (uH, uS, uV))
-        mask = cv2.erode(mask, None, iterations=2)
-        mask = cv2.dilate(mask, None, iterations=2)
-
-        # find contours in the mask
-        cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
-        
-        # find closest contours to center on each side
-        min_left = 0
-        min_right = width
-        left_contour = None
-        right_contour = None
-
-        # loop through contours
-        for c in cnts:
-            area = cv2.contourArea(c)
-
-            # look only at contours larger than the min_area
-            if area > min_area: 
-                M = cv2.moments(c)
-                cX = int((M["m10"] / M["m00"]))
-                cY = int((M["m01"] / M["m00"]))
-
-                ((x, y), radius) = cv2.minEnclosingCircle(c)
-
-                # draw a blue circle around the contour
-                cv2.circle(frame, (int(x), int(y)), int(radius), (255, 255, 0), 1)
-
-                # find the contours closest to the center x-value of the frame
-                if cX > centerX:
-                    if cX < min_right:
-                        min_right = cX
-                        right_contour = c
-                else:
-                    if cX > min_left:
-                        min_left = cX
-                        left_contour = c
-
-        # draw a yellow circle around the nearest contours
-        if right_contour is not None:
-            ((rX, rY), radius) = cv2.minEnclosingCircle(right_contour)
-            cv2.circle(frame, (int(rX), int(rY)), int(radius), (0, 255, 255), 1)
-
-        if left_contour is not None:
-            ((lX, lY), radius) = cv2.minEnclosingCircle(left_contour)
-            cv2.circle(frame, (int(lX), int(lY)), int(radius), (0, 255, 255), 1)
+        # blur, mask and open the frame for the latest bounds from the
+        # dashboard and find the targets closest to center on each side
+        mask, candidates, left, right = vision(frame, cache.current)
+        detect.draw_targets(frame, candidates, left, right)
+
+        if right is not None:
+            rX, rY = right.x, right.y
+
+        if left is not None:
+            lX, lY = left.x, left.y
 
         # interplate the distance between the centers of the two nearest contours for 11.5 inches
         if lX > 0 and rX > 0:
             try:
-                distance = interp1d([lX, rX], [0, distance_between_targets])
-                distance_from_left = distance(centerX)
-                offset_from_center = (distance_between_targets / 2) - distance_from_left
+                offset_from_center = vision.offset_from_center(lX, rX)
 
                 direction = "left" if offset_from_center > 0 else "right" if offset_from_center < 0 else "center"
                 print("The slider is {:.2f} inches {} of center".format(abs(offset_from_center), direction))
 
-                sd.putNumber("Offset", offset_from_center)
+                # confidence drops when a side is left over from an earlier frame
+                confidence = ((left is not None) + (right is not None)) / 2
+                publisher.publish(offset_from_center, captured, time.monotonic() - captured, confidence)
             except (NameError, ValueError) as e:
                 print("Error in interpolation", e)
                 pass
@@ -144,7 +109,6 @@ def main():
         # draw a center line
         cv2.line(frame, (centerX, 0), (centerX, height), (255, 255, 255), 1)
 
-        cvSource.putFrame(mask)
         outputStream.putFrame(mask)
 
 if __name__ == "__main__":
@@ -3,28 +3,106 @@
 # import necessary libraries
 import argparse
 import cv2
-import imutils
-import json
+import itertools
 import logging
 import numpy as np
+import os
+import sys
 import time
-import wpilib
 
-from cscore import CameraServer
-from imutils.video import FPS, VideoStream
+from imutils.video import FPS
 from networktables import NetworkTables
-from networktables import NetworkTablesInstance
-from scipy.interpolate import interp1d
+
+# make the shared hatchvision package importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from hatchvision import chain, detect, pyramid
+from hatchvision.bounds import BoundsCache
+from hatchvision.buffers import AllocationCounter, BufferPool
+from hatchvision.cameras import Camera, CameraState, Scheduler, parse_camera
+from hatchvision.chain import VisionChain
+from hatchvision.pipeline import Frame, LatestQueue, Stage
+from hatchvision.predict import OffsetPredictor
+from hatchvision.publish import OffsetPublisher
+from hatchvision.roi import RoiTracker
+from hatchvision.source import open_source
+from hatchvision.threshold import THRESHOLDS
+from hatchvision.timing import NO_TIMINGS, Timings
 
 def main():
     # parse arguments
     ap = argparse.ArgumentParser()
-    ap.add_argument("-w", "--width", type=int, default=640, help="set width of the frame")
-    ap.add_argument("-l", "--height", type=int, default=480, help="set height of the frame")
+    ap.add_argument("-j", "--config", default=chain.config_path(__file__), help="vision chain config")
+    ap.add_argument("-w", "--width", type=int, help="set width of the frame")
+    ap.add_argument("-l", "--height", type=int, help="set height of the frame")
     ap.add_argument("-d", "--display", type=int, default=1, help="stream to dashboard")
+    ap.add_argument("-s", "--stream_scale", type=int, default=2, help="divide the size of the dashboard streams by this")
+    ap.add_argument("-v", "--source", default="0", help="camera index, mjpeg url, cscore:<device> or video file")
+    ap.add_argument("-x", "--camera", action="append", default=[], help="name,source[,bounds table[,output key]] of a camera, repeat for each camera instead of --source")
+    ap.add_argument("-b", "--background", type=float, default=5, help="frames a second for each camera the robot has not made active")
     ap.add_argument("-n", "--num_frames", type=int, default=0, help="test frame rate with set number of frames")
+    ap.add_argument("-t", "--threshold", choices=sorted(THRESHOLDS), help="threshold engine, lut skips the hsv conversion")
+    ap.add_argument("-e", "--detector", choices=sorted(detect.DETECTORS), help="detection backend")
+    ap.add_argument("-k", "--track", type=int, default=0, help="only search a window around the last targets")
+    ap.add_argument("-y", "--pyramid", type=int, default=0, help="find blobs on a frame downscaled by this factor, then refine them")
+    ap.add_argument("-a", "--allocations", type=int, default=0, help="log the bytes allocated per frame")
+    ap.add_argument("-i", "--timing", type=int, default=0, help="publish per stage latency under Diagnostics")
+    ap.add_argument("-f", "--timing_csv", default="", help="also append the stage latencies to this csv file")
+    ap.add_argument("-p", "--workers", type=int, default=0, help="spread vision over this many worker processes")
+    ap.add_argument("-c", "--cpus", default="", help="comma separated cpus to pin the workers to")
+    ap.add_argument("-r", "--rate", type=int, default=0, help="publish filtered offsets predicted this many times a second")
+    ap.add_argument("-o", "--record", default="", help="keep the latest frames and their results in this ring file")
+    ap.add_argument("-m", "--record_slots", type=int, default=300, help="number of frames the ring file holds")
+    ap.add_argument("-g", "--budget", type=float, default=0, help="lower or raise the processing level to keep vision under this many ms")
     args = vars(ap.parse_args())
 
+    if args["track"] > 0 and args["workers"] > 0:
+        ap.error("--track needs the targets from the previous frame and cannot be used with --workers")
+
+    if args["pyramid"] > 1 and args["workers"] > 0:
+        ap.error("--pyramid cannot be used with --workers")
+
+    if args["budget"] > 0 and (args["workers"] > 0 or args["pyramid"] > 1):
+        ap.error("--budget cannot be used with --workers or --pyramid")
+
+    if args["record"] and args["workers"] > 0:
+        ap.error("--record cannot be used with --workers")
+
+    # the workers can only be pinned to cpus this process may run on
+    cpus = None
+    if args["cpus"]:
+        try:
+            cpus = [int(cpu) for cpu in args["cpus"].split(",")]
+        except ValueError:
+            ap.error("--cpus takes comma separated cpu numbers")
+        if hasattr(os, "sched_getaffinity"):
+            allowed = os.sched_getaffinity(0)
+            if not set(cpus) <= allowed:
+                ap.error("--cpus {} are not available, choose from {}".format(
+                    ",".join(str(cpu) for cpu in sorted(set(cpus) - allowed)), ",".join(str(cpu) for cpu in sorted(allowed))))
+
+    # the vision chain is declared in the config, the frame size, threshold
+    # engine and detector options win over it
+    try:
+        vision = chain.override(chain.load(args["config"]), args["width"], args["height"],
+                                args["threshold"], backend=args["detector"])
+        chain.stages(vision)
+    except (IOError, KeyError, ValueError) as e:
+        ap.error("{}: {}".format(args["config"], e))
+
+    try:
+        configs = [parse_camera(spec) for spec in args["camera"]]
+    except ValueError as e:
+        ap.error(str(e))
+
+    if len(set(config.name for config in configs)) < len(configs):
+        ap.error("every --camera needs a name of its own")
+
+    # without --camera the one camera reads its bounds from the dashboard and
+    # publishes Offset the way it always has
+    if not configs:
+        configs = [Camera("", args["source"], "", "Offset")]
+
     # setup up logging
     logging.basicConfig(level=logging.DEBUG)
 
@@ -33,134 +111,352 @@ def main():
     sd = NetworkTables.getTable("SmartDashboard")
 
     # initialize some variables
-    width = args["width"]
-    height = args["height"]
-    min_area = 100
-    centerX = width // 2
-    distance_between_targets = 11.5
-    lX = lY = rX = rY = 0
-
-    # set up the camera
-    vs = VideoStream(src=0).start()
+    width = vision["width"]
+    height = vision["height"]
+
+    # per stage latency percentiles, published under SmartDashboard/Diagnostics
+    if args["timing"] > 0:
+        timings = Timings(sd.getSubTable("Diagnostics"), args["timing_csv"] or None)
+    else:
+        timings = NO_TIMINGS
+
+    # set up the cameras at the frame size so nothing has to be resized, and
+    # wait for them to deliver instead of sleeping
+    sources = []
+    for config in configs:
+        sources.append(open_source(config.source, width, height))
+        if not sources[-1].first(5.0):
+            for source in sources:
+                source.stop()
+            sys.exit("No frames from {}".format(config.source))
     fps = FPS().start()
 
-    # setup the stream if required
+    # setup the stream if required, the dashboard sets the fps and bitrate
+    # caps of each under SmartDashboard/Stream; cscore is only loaded for it
     if args["display"] > 0:
-        camServer = CameraServer.getInstance()
-        frameStream = camServer.putVideo("Frame", width, height)
-        maskStream = camServer.putVideo("Mask", width, height)
-
-    # initialize frame holders to save time
-    frame   = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-    grayed  = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-    blurred = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-    hsv     = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-    mask    = np.zeros(shape=(height, width, 3), dtype=np.uint8)
-
-    count = 0
-
-    while True:
-    # while fps._numFrames < args["num_frames"]:
-        frame = vs.read()
-        frame = imutils.resize(frame, width=width, height=height) # Initially 370 FPS 
-
-        # gray, blur frame and convert it to hsv color space
-        # blurred = cv2.GaussianBlur(frame, (5, 5), 0)  # drops FPS to 2 
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)  # drops FPS to 1.5 with blur
-
-        # get the bounds from the dashboard
-        lH = sd.getNumber("H-Lower", 0)
-        uH = sd.getNumber("H-Upper", 180)
-
-        lS = sd.getNumber("S-Lower", 0)
-        uS = sd.getNumber("S-Upper", 255)
-
-        lV = sd.getNumber("V-Lower", 0)
-        uV = sd.getNumber("V-Upper", 255)
-
-        # construct a mask for the bounds then erode and dilate it
-        mask = cv2.inRange(hsv, (lH, lS, lV), (uH, uS, uV))  # drops FPS to 10 wihout blur
-        mask = cv2.erode(mask, None, iterations=2)
-        mask = cv2.dilate(mask, None, iterations=2)
-
-        # find contours in the mask
-        cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
-        
-        # find closest contours to center on each side
-        min_left = 0
-        min_right = width
-        left_contour = None
-        right_contour = None
-
-        # loop through contours
-        for c in cnts:
-            area = cv2.contourArea(c)
-
-            # look only at contours larger than the min_area
-            if area > min_area: 
-                M = cv2.moments(c)
-                cX = int((M["m10"] / M["m00"]))
-                cY = int((M["m01"] / M["m00"]))
-
-                ((x, y), radius) = cv2.minEnclosingCircle(c)
-
-                # draw a blue circle around the contour
-                cv2.circle(frame, (int(x), int(y)), int(radius), (255, 255, 0), 1)
-
-                # find the contours closest to the center x-value of the frame
-                if cX > centerX:
-                    if cX < min_right:
-                        min_right = cX
-                        right_contour = c
-                else:
-                    if cX > min_left:
-                        min_left = cX
-                        left_contour = c
-
-        # draw a yellow circle around the nearest contours
-        if right_contour is not None:
-            ((rX, rY), radius) = cv2.minEnclosingCircle(right_contour)
-            cv2.circle(frame, (int(rX), int(rY)), int(radius), (0, 255, 255), 1)
+        from cscore import CameraServer
+        from hatchvision.stream import DashboardStream
 
-        if left_contour is not None:
-            ((lX, lY), radius) = cv2.minEnclosingCircle(left_contour)
-            cv2.circle(frame, (int(lX), int(lY)), int(radius), (0, 255, 255), 1)
+        scale = max(args["stream_scale"], 1)
+        camServer = CameraServer.getInstance()
+        streamTable = sd.getSubTable("Stream")
+        frameStream = DashboardStream(camServer.putVideo("Frame", width // scale, height // scale),
+                                      streamTable.getSubTable("Frame"), scale)
+        maskStream = DashboardStream(camServer.putVideo("Mask", width // scale, height // scale),
+                                     streamTable.getSubTable("Mask"), scale, interpolation=cv2.INTER_NEAREST)
+
+    # initialize frame holders to save time, capture fills the frame buffers in
+    # turn and hands them on so it never writes to one that vision is reading,
+    # and the stream gets copies of its own to draw on; every camera can have
+    # one being filled and one waiting
+    frame_buffers = BufferPool((height, width, 3), 2 * len(configs) + (2 if args["record"] else 1))
+    stream_buffers = BufferPool((height, width, 3), 2)
+    mask_buffers = BufferPool((height, width), 2)
+    mask    = np.zeros(shape=(height, width), dtype=np.uint8)
+
+    # frame sequence numbers shared by every capture thread, next is atomic
+    sequence = itertools.count(1)
+
+    # the stages pass work along through queues that only keep the newest item,
+    # the offsets and the dashboard streams get separate queues so a slow
+    # stream encode can never hold up the offset the slider relies on
+    def release_stream(item):
+        if item[0] is not None:
+            stream_buffers.release(item[0])
+        if item[1] is not None:
+            mask_buffers.release(item[1])
+
+    # the scheduler keeps the newest frame of each camera and hands vision the
+    # active camera's first, the robot names it under ActiveCamera
+    frames = Scheduler([config.name for config in configs], args["background"],
+                       on_drop=lambda item: frame_buffers.release(item.image))
+    frames.watch(sd)
+    # a replay publishes every offset, live cameras only the newest ones
+    offsets = LatestQueue(len(configs), wait=not any(source.live for source in sources))
+    streams = LatestQueue(1, on_drop=release_stream)
+
+    # capture: copy the newest camera frame into a free buffer, the source
+    # itself lets the frames go that nobody got to; a file source stops its
+    # stage at the end, which closes the camera's feed
+    def capture(camera):
+        image = frame_buffers.acquire()
+        if image is None:
+            # every buffer is queued or in use
+            time.sleep(0.001)
+            return None
+
+        tick = timings.start()
+        captured, result = camera.source.read(image, timeout=0.5)
+        timings.lap("capture", tick)
+        if result is None:
+            frame_buffers.release(image)
+            if camera.source.finished:
+                raise StopIteration
+            return None
+
+        return Frame(next(sequence), captured, image, camera.index)
+
+    # publish: send the offset to the roborio under its camera's key along
+    # with how old its frame is
+    def publish(item):
+        offset_from_center, captured, confidence, index = item
+        direction = "left" if offset_from_center > 0 else "right" if offset_from_center < 0 else "center"
+        # print("The slider is {:.2f} inches {} of center".format(abs(offset_from_center), direction))
+
+        tick = timings.start()
+        cameras[index].publisher.publish(offset_from_center, captured, time.monotonic() - captured, confidence)
+        timings.lap("publish", tick)
+
+    # stream: draw the targets on the stream's own copy and send whichever of
+    # the frame and mask the dashboard wanted
+    def stream(item):
+        tick = timings.start()
+        frame, mask, candidates, left, right = item
+        if frame is not None:
+            detect.draw_targets(frame, candidates, left, right)
+
+            # draw a center line
+            # cv2.line(frame, (centerX, 0), (centerX, height), (255, 255, 255), 1)
+
+            frameStream.put(frame)
+
+        if mask is not None:
+            maskStream.put(mask)
+
+        release_stream(item)
+        timings.lap("stream", tick)
+
+    # each camera's bounds are cached from its table by an entry listener,
+    # the threshold engine of its chain only rebuilds what it derives from
+    # them when they change; with a rate the targets only feed a filter per
+    # camera and a source stage publishes their predictions at that rate,
+    # however slowly detection is running
+    cameras = []
+    for index, (config, source) in enumerate(zip(configs, sources)):
+        table = sd.getSubTable(config.table) if config.table else sd
+        compiled = VisionChain(vision, (width, height), timings)
+        predictor = None
+        if args["rate"] > 0:
+            predictor = OffsetPredictor(compiled.centerX, compiled.distance_between_targets)
+        cameras.append(CameraState(index, config, source, BoundsCache(table), compiled,
+                                   OffsetPublisher(sd, NetworkTables.flush, config.key), RoiTracker(), predictor))
+
+    def bounds(index):
+        return cameras[index].cache.current
+
+    next_prediction = time.monotonic()
+
+    def predict():
+        nonlocal next_prediction
+        next_prediction += 1 / args["rate"]
+        time.sleep(max(0, next_prediction - time.monotonic()))
+
+        now = time.monotonic()
+        if now - next_prediction > 1 / args["rate"]:
+            # fell behind, start counting again instead of bursting
+            next_prediction = now
+
+        for camera in cameras:
+            predicted = camera.predictor.predict(now)
+            if predicted is not None:
+                offset_from_center, confidence = predicted
+                offsets.put((offset_from_center, now, confidence, camera.index))
+
+    # turn the nearest targets into an offset and hand the results on
+    def targets(camera, captured, frame, mask, candidates, left, right):
+        # returns the offset and confidence that were published, if any
+        published = None
+
+        # the filter smooths each side and carries it through dropouts itself
+        if camera.predictor is not None:
+            camera.predictor.update(captured, left, right)
+
+        if right is not None:
+            camera.rX, camera.rY = right.x, right.y
+
+        if left is not None:
+            camera.lX, camera.lY = left.x, left.y
 
         # interplate the distance between the centers of the two nearest contours for 11.5 inches
-        if lX > 0 and rX > 0:
+        lX, rX = camera.lX, camera.rX
+        if camera.predictor is None and lX > 0 and rX > 0:
             try:
-                distance = interp1d([lX, rX], [0, distance_between_targets])
-                distance_from_left = distance(centerX)
-                offset_from_center = (distance_between_targets / 2) - distance_from_left
-
-                direction = "left" if offset_from_center > 0 else "right" if offset_from_center < 0 else "center"
-                # print("The slider is {:.2f} inches {} of center".format(abs(offset_from_center), direction))
+                offset_from_center = camera.chain.offset_from_center(lX, rX)
 
-                sd.putNumber("Offset", offset_from_center)
-            except (NameError, ValueError) as e:
+                # confidence drops when a side is left over from an earlier frame
+                confidence = ((left is not None) + (right is not None)) / 2
+                offsets.put((offset_from_center, captured, confidence, camera.index))
+                published = (offset_from_center, confidence)
+            except ValueError as e:
                 # print("Error in interpolation", e)
                 pass
 
-        # draw a center line
-        # cv2.line(frame, (centerX, 0), (centerX, height), (255, 255, 255), 1)
-
-        if args["display"] > 0:
-            frameStream.putFrame(frame)
-            maskStream.putFrame(mask)
+        # the stream stage gets copies it owns of what is due to be sent from
+        # the camera being shown, or skips this frame when no one is watching,
+        # a cap holds it back or its buffers are still busy
+        if args["display"] > 0 and camera.index == frames.shown():
+            now = time.monotonic()
+            image = stream_buffers.acquire() if frameStream.wanted(now) else None
+            copy = mask_buffers.acquire() if maskStream.wanted(now) else None
+            if image is not None or copy is not None:
+                if image is not None:
+                    np.copyto(image, frame)
+                if copy is not None:
+                    np.copyto(copy, mask)
+                streams.put((image, copy, candidates, left, right))
 
         # update the fps if set
         if args["num_frames"] > 0:
             fps.update()
 
+        return published
+
+    # a recording is replayed frame by frame, its capture waits for vision
+    # instead of skipping frames so a replay always gives the same results
+    stages = [Stage("capture-{}".format(camera.camera.name) if camera.camera.name else "capture",
+                    lambda camera=camera: capture(camera),
+                    outboxes=(frames.feed(camera.index, wait=not camera.source.live),))
+              for camera in cameras]
+    stages.append(Stage("publish", publish, inbox=offsets))
+    if args["display"] > 0:
+        stages.append(Stage("stream", stream, inbox=streams))
+    if args["rate"] > 0:
+        stages.append(Stage("predict", predict))
+
+    for stage in stages:
+        stage.start()
+
+    # the recorder copies each frame into its ring on its own thread and hands
+    # the buffer back when it is done with it
+    recorder = None
+    if args["record"]:
+        from hatchvision.recorder import RingRecorder
+        recorder = RingRecorder(args["record"], width, height, args["record_slots"],
+                                wait=not any(source.live for source in sources))
+
+    pool = None
+    try:
+        if args["workers"] > 0:
+            # hand the newest frames to a pool of worker processes, the results
+            # come back in capture order and live in shared memory
+            from hatchvision.shard import ShardPool
+
+            pool = ShardPool(args["workers"], vision, width, height, cpus)
+            pool.start(frames, bounds, frame_buffers.release)
+
+            for result in pool.ordered():
+                targets(cameras[result.camera], result.timestamp, result.frame, result.mask, result.candidates, result.left, result.right)
+                if args["num_frames"] > 0 and fps._numFrames >= args["num_frames"]:
+                    break
+        else:
+            # vision runs on the main thread and always takes the newest frame
+            # the scheduler hands it
+            counter = AllocationCounter() if args["allocations"] > 0 else None
+
+            # the governor trades resolution, blur and morphology for time,
+            # starting from the chain as declared, and shows its level on the
+            # dashboard
+            governor = None
+            if args["budget"] > 0:
+                from hatchvision.governor import Governor, ladder
+                governor = Governor(args["budget"] / 1000, ladder(cameras[0].chain), table=sd)
+            while args["num_frames"] == 0 or fps._numFrames < args["num_frames"]:
+                item = frames.get()
+                if item is None:
+                    break
+                frame = item.image
+                camera = cameras[item.camera]
+                tracker = camera.tracker
+                compiled = camera.chain
+
+                if counter is not None:
+                    counter.frame_start()
+                start = timings.start()
+                began = time.perf_counter()
+
+                # only search a window around the last targets when tracking
+                if args["track"] > 0:
+                    window = tracker.window(frame)
+                else:
+                    window = (0, 0, width, height)
+                x, y, w, h = window
+
+                # the stream shows the window inside an otherwise empty mask
+                if args["track"] > 0 and args["display"] > 0:
+                    mask.fill(0)
+
+                # construct a mask for the bounds and find the targets closest
+                # to center on each side, blurring the frame first drops FPS to 2;
+                # the pyramid and the governor scale the chain's blur and
+                # morphology with the frame
+                view = mask[y:y + h, x:x + w]
+                if args["pyramid"] > 1:
+                    small, candidates, left, right = pyramid.find_targets(
+                        frame[y:y + h, x:x + w], compiled, camera.cache.current, args["pyramid"], (x, y))
+
+                    # the stream shows the coarse mask at full size
+                    if args["display"] > 0:
+                        cv2.resize(small, (w, h), dst=view, interpolation=cv2.INTER_NEAREST)
+                elif governor is not None:
+                    small, candidates, left, right = governor.find_targets(
+                        frame[y:y + h, x:x + w], compiled, camera.cache.current, view, (x, y))
+
+                    # below full resolution the stream shows the small mask at full size
+                    if args["display"] > 0 and small.shape != view.shape:
+                        cv2.resize(small, (w, h), dst=view, interpolation=cv2.INTER_NEAREST)
+                else:
+                    view, candidates, left, right = compiled(frame[y:y + h, x:x + w], camera.cache.current, (x, y), view)
+
+                if args["track"] > 0:
+                    tracker.update(window, frame, left, right)
+
+                published = targets(camera, item.timestamp, frame, mask, candidates, left, right)
+                timings.lap("vision", start)
+                elapsed = time.perf_counter() - began
+                if governor is not None:
+                    governor.observe(elapsed)
+
+                # the ring keeps the frames of the camera being shown
+                if recorder is not None and camera.index == frames.shown():
+                    offset_from_center, confidence = published or (np.nan, 0)
+                    recorder.put(item.image, (item.timestamp, offset_from_center, confidence,
+                                              left.x if left is not None else np.nan,
+                                              right.x if right is not None else np.nan, elapsed * 1000),
+                                 frame_buffers.release)
+                else:
+                    frame_buffers.release(item.image)
+
+                if counter is not None:
+                    counter.frame_end()
+    finally:
+        # closing the scheduler lets a capture waiting to hand over go
+        frames.close()
+        for stage in stages:
+            stage.stop()
+
+        for stage in stages:
+            stage.join()
+
+        if pool is not None:
+            pool.close()
+
+        # flush the frames of the match to disk
+        if recorder is not None:
+            recorder.close()
+
+        timings.close()
+
     # stop the timer and display the results
     if args["num_frames"] > 0:
         fps.stop()
         print("[INFO] elapsed time: {:.2f}".format(fps.elapsed()))
         print("[INFO] approx FPS: {:.2f}".format(fps.fps()))
 
-    vs.stop()
+    for camera in cameras:
+        print("[INFO] {}camera frames: {}, dropped: {}".format(
+            camera.camera.name + " " if camera.camera.name else "", camera.source.count, camera.source.dropped))
+        camera.source.stop()
+    print("[INFO] frames skipped for newer ones: {}".format(frames.dropped))
 
 if __name__ == "__main__":
     main()
-
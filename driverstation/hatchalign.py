@@ -1,136 +1,119 @@
 #!/usr/env/python3
 
 # import necessary libraries
-import numpy as np
 import argparse
 import cv2
-import imutils
+import os
 import sys
-import time
-import threading
 
-from imutils.video import VideoStream
 from imutils.video import FPS
 from networktables import NetworkTables
 from networktables import NetworkTablesInstance
-from scipy.interpolate import interp1d
+
+# make the shared hatchvision package importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from hatchvision import chain, detect
+from hatchvision.chain import VisionChain
+from hatchvision.display import Display
+from hatchvision.roi import RoiTracker
+from hatchvision.source import open_source
 
 # parse arguments
 ap = argparse.ArgumentParser()
 ap.add_argument("-r", "--roborio", nargs="?", default="127.0.0.1", help="address to the roborio")
-ap.add_argument("-l", "--lower", nargs="+", type=int, default=[113, 0, 197], help="HSV lower bounds")
-ap.add_argument("-u", "--upper", nargs="+", type=int, default=[157, 10, 255], help="HSV upper bounds")
+ap.add_argument("-j", "--config", default=chain.config_path(__file__), help="vision chain config")
+ap.add_argument("-l", "--lower", nargs="+", type=int, help="HSV lower bounds")
+ap.add_argument("-u", "--upper", nargs="+", type=int, help="HSV upper bounds")
 ap.add_argument("-v", "--video", help="path to the video file")
 ap.add_argument("-s", "--show", nargs="?", const="show", help="display a window of the frames")
+ap.add_argument("-f", "--refresh", type=int, default=30, help="most times a second the window is repainted")
+ap.add_argument("-d", "--detector", choices=sorted(detect.DETECTORS), help="detection backend")
+ap.add_argument("-t", "--track", nargs="?", const="track", help="only search a window around the last targets")
 args = vars(ap.parse_args())
 
+# the vision chain is declared in the config, the bounds and detector options
+# win over it
+try:
+    config = chain.override(chain.load(args["config"]), lower=args["lower"], upper=args["upper"],
+                            backend=args["detector"])
+    chain.stages(config)
+except (IOError, KeyError, ValueError) as e:
+    ap.error("{}: {}".format(args["config"], e))
+
 # connect to the roborio network tables
 print("Connecting to ", args["roborio"])
 NetworkTables.initialize(server=args["roborio"])
 livewindow = NetworkTablesInstance.getDefault().getTable("Shuffleboard/LiveWindow")
 
-# set the video stream
-if args.get("video", True):
-    vs = cv2.VideoCapture(args["video"])
-    if vs.isOpened():
-        width = int(vs.get(3))
-        height = int(vs.get(4))
-    else:
-        sys.exit("Cannot open video")
-else:
-    vs = VideoStream("http://192.168.24.70:6050/frame.mjpg").start()
-    if vs.stream.isOpened():
-        width = int(vs.stream.get(3))
-        height = int(vs.stream.get(4))
-    else:
-        sys.exit("Cannot open stream")
+# set the video stream, frames come at the width the targets are found at and
+# the first one is waited for instead of sleeping
+try:
+    vs = open_source(args["video"] or "http://192.168.24.70:6050/frame.mjpg", config["width"], config.get("height", 0))
+except IOError as e:
+    sys.exit(str(e))
+width, height = vs.width, vs.height
 
-fps = FPS().start()
+if not vs.first(5.0):
+    sys.exit("No frames from the video source")
 
-# allow networktables, camera or video file to load
-time.sleep(2.0)
+fps = FPS().start()
 
 print("Video source W:", width, " - H:", height)
 
 # set some variables
-lower = tuple(args["lower"]) # lower bounds of retro-reflective tape
-upper = tuple(args["upper"]) # upper bounds of retro-reflective tape
-centerX = 300         # center x-value of frame
+vision = VisionChain(config, (width, height))
+centerX = vision.centerX  # center x-value of frame
 lX = lY = rX = rY = 0
 
+# the window is drawn and repainted on a thread of its own, only when shown
+def annotate(frame, candidates, left, right):
+    detect.draw_targets(frame, candidates, left, right)
+
+    # draw center line
+    cv2.line(frame, (centerX, 0), (centerX, height), (255, 255, 255), 1)
+
+display = Display(annotate, fps=args["refresh"]).start() if args.get("show", True) else None
+tracker = RoiTracker()
+
 # keep looping
+resized = None
 while True:
-    # grab the current frame
-    frame = vs.read()
-
-    # handle the gram from VideoCapture or VideoStream
-    frame = frame[1] if args.get("video", False) else frame
+    # grab the newest frame into the same buffer every time
+    timestamp, resized = vs.read(resized)
 
     # if we are viewing a video and did not grab a frame, we are at end of video
-    if frame is None:
+    if resized is None:
         break
     
     # update the FPS counter
     fps.update()
 
-    # resize the frame, blur it, and convert it to the HSV colour space
-    resized = imutils.resize(frame, width=600)
-    blurred = cv2.GaussianBlur(resized, (11, 11), 0)
-    hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
-    # ratio = frame.shape[0] / float(resized.shape[0])
+    # only search a window around the last targets when tracking
+    if args.get("track", False):
+        window = tracker.window(resized)
+    else:
+        window = (0, 0, resized.shape[1], resized.shape[0])
+    x, y, w, h = window
 
-    # construct a mask for the bounds, then erode and dilate
-    mask = cv2.inRange(hsv, lower, upper)
-    mask = cv2.erode(mask, None, iterations=2)
-    mask = cv2.dilate(mask, None, iterations=2)
+    # blur, mask and open the window and find the targets closest to center
+    # on each side
+    mask, candidates, left, right = vision(resized[y:y + h, x:x + w], offset=(x, y))
 
-    # find contours in the mask
-    cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    cnts = imutils.grab_contours(cnts)
-    
-    # find closest contours to center on each side
-    min_left = 0
-    min_right = 600
-    left_contour = None
-    right_contour = None
-    
-    for c in cnts:
-        area = cv2.contourArea(c)
-        # print("ML: ", min_left, " - MR: ", min_right)
-        if area > 100: # ignore any noise
-            M = cv2.moments(c)
-            cX = int((M["m10"] / M["m00"]))
-            cY = int((M["m01"] / M["m00"]))
-
-            ((x, y), radius) = cv2.minEnclosingCircle(c)
-            cv2.circle(resized, (int(x), int(y)), int(radius), (255, 255, 0), 1) # draw a blue cirle around the contour
-           
-            # find the contours closest to the center x-value of the frame
-            if cX > centerX:
-                if cX < min_right:
-                    min_right = cX
-                    right_contour = c
-            else:
-                if cX > min_left:
-                    min_left = cX
-                    left_contour = c
-    
-    # draw a yellow circle around nearest contours
-    if right_contour is not None:
-        ((rX, rY), radius) = cv2.minEnclosingCircle(right_contour)
-        cv2.circle(resized, (int(rX), int(rY)), int(radius), (0, 255, 255), 1)
-        
-    if left_contour is not None:
-        ((lX, lY), radius) = cv2.minEnclosingCircle(left_contour)
-        cv2.circle(resized, (int(lX), int(lY)), int(radius), (0, 255, 255), 1)
+    if args.get("track", False):
+        tracker.update(window, resized, left, right)
+
+    if right is not None:
+        rX, rY = right.x, right.y
+
+    if left is not None:
+        lX, lY = left.x, left.y
         
     # interpolate the distance between the centers of the two nearest contours for 11.5 inches
     if lX > 0 and rX > 0:
         # print("cX: {:.2f}, lX: {:.2f}, rX: {:.2f}".format(centerX, lX, rX))
         try:
-            distance = interp1d([lX, rX], [0, 11.5])
-            distance_from_left = distance(centerX)
-            offset_from_center = 5.75 - distance_from_left
+            offset_from_center = vision.offset_from_center(lX, rX)
         
             direction = "right" if offset_from_center > 0 else "left" if offset_from_center < 0 else "center"
             print("Move the slider {:.2f} inches {}".format(abs(offset_from_center), direction))
@@ -140,17 +123,11 @@ while True:
         except (NameError, ValueError) as e:
             print("Error in interpolation",e)
             pass
-    
-    # draw center line
-    cv2.line(resized, (centerX, 0), (centerX, height), (255, 255, 255), 1)
-    
-    # show the frame to our screen and increment the frame counter
-    if args.get("show", True):
-        cv2.imshow("Frame:", resized)
 
-        # if the 'q' key is pressed, stop the loop
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord("q"):
+    # hand the frame to the display, which stops the loop when 'q' is pressed
+    if display is not None:
+        display.put(resized, candidates, left, right)
+        if display.stopped.is_set():
             break
 
 # stop the timer and display FPS information
@@ -159,10 +136,9 @@ print("Elasped time: {:.2f}".format(fps.elapsed()))
 print("FPS: {:.2f}".format(fps.fps()))
 
 # close the video stream
-if not args.get("video", False):
-    vs.stop()
-else:
-    vs.release()
+print("Frames: {}, dropped: {}".format(vs.count, vs.dropped))
+vs.stop()
 
-# close all windows
-cv2.destroyAllWindows()
+# close the window
+if display is not None:
+    display.stop()
@@ -0,0 +1 @@
+# shared vision code for the hatch alignment scripts
@@ -0,0 +1,152 @@
+# offline analysis of recorded clips
+#
+# decodes and processes many clips at once, one clip per worker process,
+# each through the vision chain of the driver station script unless another
+# config is given. every clip gets a csv with a row per frame and summary.csv
+# gets a row per clip. frames are streamed from the decoder one at a time so
+# memory stays flat however long the clip is:
+#
+#   python -m hatchvision.batch "matches/*.avi" -o analysis/ -p 4
+
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from hatchvision import chain, detect
+from hatchvision.bench import FrameDetector, clip_frames, find_clips
+from hatchvision.bounds import Bounds
+from hatchvision.source import target_size
+from hatchvision.threshold import THRESHOLDS
+
+# the chain the driver station runs
+DRIVER_STATION_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     "driverstation", "hatchalign.json")
+
+FRAME_COLUMNS = ["frame", "lX", "rX", "offset", "candidates", "ms"]
+SUMMARY_COLUMNS = ["clip", "frames", "offsets", "found", "mean_candidates", "mean_ms", "p95_ms", "fps", "output"]
+
+
+def blank(value):
+    return "" if value is None else round(value, 3)
+
+
+def analyse(job):
+    # one clip in a worker process, returns its summary row
+    clip, output, settings = job
+    cv2.setNumThreads(1)
+
+    config = settings["config"]
+    find = FrameDetector(config)
+    bounds = settings["bounds"]
+
+    frames = offsets = candidates = 0
+    latencies = []
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FRAME_COLUMNS)
+
+        for frame in clip_frames(clip):
+            # at the size the frame sources would deliver
+            size = target_size(frame.shape[1::-1], config["width"], config.get("height", 0))
+            if size != frame.shape[1::-1]:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            if frames == 0:
+                find.chain(size[0], size[1], bounds)
+
+            start = time.perf_counter()
+            found, left, right, offset = find(frame, bounds)
+            ms = (time.perf_counter() - start) * 1000
+
+            writer.writerow([frames, blank(left and left.x), blank(right and right.x), blank(offset), len(found), round(ms, 3)])
+            frames += 1
+            offsets += offset is not None
+            candidates += len(found)
+            latencies.append(ms)
+
+    latencies = np.array(latencies)
+    return {
+        "clip": clip,
+        "frames": frames,
+        "offsets": offsets,
+        "found": round(offsets / frames, 4) if frames else 0,
+        "mean_candidates": round(candidates / frames, 3) if frames else 0,
+        "mean_ms": round(latencies.mean(), 3) if frames else 0,
+        "p95_ms": round(np.percentile(latencies, 95), 3) if frames else 0,
+        "fps": round(frames / latencies.sum() * 1000, 1) if frames else 0,
+        "output": output,
+    }
+
+
+def outputs(clips, folder):
+    # a csv per clip named after it, numbered when two clips share a name
+    paths, used = [], set()
+    for clip in clips:
+        stem = os.path.splitext(os.path.basename(clip))[0]
+        name, n = stem, 1
+        while name in used:
+            n += 1
+            name = "{}-{}".format(stem, n)
+        used.add(name)
+        paths.append(os.path.join(folder, name + ".csv"))
+    return paths
+
+
+def main():
+    # parse arguments
+    ap = argparse.ArgumentParser(description="analyse recorded clips without a display")
+    ap.add_argument("clips", nargs="+", help="video files, folders or globs to analyse")
+    ap.add_argument("-o", "--output", default="analysis", help="folder for the csv files")
+    ap.add_argument("-p", "--processes", type=int, default=os.cpu_count(), help="number of clips to analyse at once")
+    ap.add_argument("-l", "--lower", nargs="+", type=int, default=[113, 0, 197], help="HSV lower bounds")
+    ap.add_argument("-u", "--upper", nargs="+", type=int, default=[157, 10, 255], help="HSV upper bounds")
+    ap.add_argument("-j", "--config", default=DRIVER_STATION_CONFIG, help="vision chain config, the driver station's by default")
+    ap.add_argument("-t", "--threshold", choices=sorted(THRESHOLDS), help="threshold engine")
+    ap.add_argument("-d", "--detector", choices=sorted(detect.DETECTORS), help="detection backend")
+    ap.add_argument("-w", "--width", type=int, help="resize frames to this width, 0 keeps them as they are")
+    ap.add_argument("-b", "--blur", type=int, help="gaussian kernel size, 0 is off")
+    ap.add_argument("-m", "--morphology", type=int, help="erode and dilate iterations")
+    args = vars(ap.parse_args())
+
+    # the options win over the config
+    try:
+        config = chain.override(chain.load(args["config"]), args["width"], 0 if args["width"] is not None else None,
+                                args["threshold"], backend=args["detector"], blur=args["blur"],
+                                iterations=args["morphology"])
+        chain.stages(config)
+    except (IOError, KeyError, ValueError) as e:
+        ap.error("{}: {}".format(args["config"], e))
+
+    clips = find_clips(args["clips"])
+    if not clips:
+        sys.exit("No clips found")
+
+    os.makedirs(args["output"], exist_ok=True)
+    settings = {
+        "bounds": Bounds(0, tuple(args["lower"]), tuple(args["upper"])),
+        "config": config,
+    }
+    jobs = [(clip, output, settings) for clip, output in zip(clips, outputs(clips, args["output"]))]
+
+    # start the biggest files first so a long clip does not finish alone at the end
+    jobs.sort(key=lambda job: -os.path.getsize(job[0]))
+
+    rows = []
+    with mp.Pool(max(1, min(args["processes"], len(jobs)))) as pool:
+        for row in pool.imap_unordered(analyse, jobs):
+            print("{clip}: {frames} frames, offset in {found:.1%}, {fps} fps".format(**row))
+            rows.append(row)
+
+    with open(os.path.join(args["output"], "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda row: row["clip"]))
+
+
+if __name__ == "__main__":
+    main()
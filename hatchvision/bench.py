@@ -0,0 +1,257 @@
+# benchmark the detection pipeline on recorded match video
+#
+# replays every clip through the vision chain of a script's config with each
+# threshold engine, detector and resolution, with no camera, display or
+# networktables, and reports fps, per frame latency percentiles and peak rss
+# as json so runs on different commits can be compared:
+#
+#   python -m hatchvision.bench clips/ -o bench.json
+
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from hatchvision import chain, detect, pyramid
+from hatchvision.bounds import Bounds
+from hatchvision.chain import VisionChain
+from hatchvision.recorder import RING_SUFFIX, RingSource
+from hatchvision.threshold import THRESHOLDS, LutThreshold
+
+CLIP_EXTENSIONS = (".avi", ".mp4", ".mkv", ".mov", ".mjpg", ".mjpeg", RING_SUFFIX)
+
+# the chain the robot runs
+ROBOT_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "RPi", "hatchalign.json")
+
+
+def find_clips(paths):
+    # expand folders and globs into a sorted list of video files
+    clips = []
+    for path in paths:
+        if os.path.isdir(path):
+            clips.extend(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(CLIP_EXTENSIONS))
+        else:
+            clips.extend(glob.glob(path))
+    return sorted(clips)
+
+
+def clip_frames(path, size=None):
+    # yield the frames of a clip one at a time, resized to size if given;
+    # frames of a recording are views straight into the file
+    if path.endswith(RING_SUFFIX):
+        source = RingSource(path)
+        while True:
+            frame = source.read()[1]
+            if frame is None:
+                return
+            if size is not None and frame.shape[1::-1] != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            yield frame
+
+    vs = cv2.VideoCapture(path)
+    try:
+        while True:
+            grabbed, frame = vs.read()
+            if not grabbed:
+                break
+            if size is not None and frame.shape[1::-1] != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            yield frame
+    finally:
+        vs.release()
+
+
+class FrameDetector:
+    # runs one frame through the vision chain of config the way the scripts
+    # do, then works out the offset; the chain is compiled for each frame
+    # size it is given with min_area kept the same share of the frame as at
+    # the configured width, and scale above 1 finds the targets with the
+    # pyramid from the same chain
+    def __init__(self, config, scale=0):
+        self.config = config
+        self.scale = scale
+        self.chains = {}
+
+    def chain(self, width, height, bounds=None):
+        # the chain for a frame size, with a lut built up front for bounds
+        # so the hsv fallback is not what gets measured
+        vision = self.chains.get((width, height))
+        if vision is None:
+            vision = self.chains[width, height] = VisionChain(self.config, (width, height))
+            if self.config.get("width", 0) > 0:
+                vision.min_area *= (width / self.config["width"]) ** 2
+        if bounds is not None and isinstance(vision.threshold, LutThreshold):
+            vision.threshold.build(bounds)
+        return vision
+
+    def __call__(self, frame, bounds):
+        # returns the candidates, the nearest left and right targets and the
+        # offset, which is None unless both targets were found around the center
+        height, width = frame.shape[:2]
+        vision = self.chain(width, height)
+
+        if self.scale > 1:
+            mask, candidates, left, right = pyramid.find_targets(frame, vision, bounds, self.scale)
+        else:
+            mask, candidates, left, right = vision(frame, bounds)
+
+        offset = None
+        if left is not None and right is not None:
+            try:
+                offset = vision.offset_from_center(left.x, right.x)
+            except ValueError:
+                pass
+
+        return candidates, left, right, offset
+
+
+def combinations(sizes, thresholds, detectors, scales):
+    # the pyramid has its own detector, so its rows are not repeated for
+    # every backend and show "-" instead
+    seen = set()
+    for size in sizes:
+        for threshold in thresholds:
+            for detector in detectors:
+                for scale in scales:
+                    key = (size, threshold, "-" if scale > 1 else detector, scale)
+                    if key not in seen:
+                        seen.add(key)
+                        yield key
+
+
+def run(clips, config, size, threshold, detector, scale, bounds, limit, results):
+    # one combination, run in its own process so its peak rss is its own
+    config = chain.override(config, engine=threshold, backend="contours" if detector == "-" else detector)
+    find = FrameDetector(config, scale)
+    find.chain(size[0], size[1], bounds)
+    latencies = []
+    found = 0
+
+    for clip in clips:
+        for i, frame in enumerate(clip_frames(clip, size)):
+            if limit and i >= limit:
+                break
+
+            start = time.perf_counter()
+            offset = find(frame, bounds)[3]
+            latencies.append(time.perf_counter() - start)
+            found += offset is not None
+
+    # ru_maxrss is in kilobytes on linux
+    latencies = np.array(latencies) * 1000
+    results.put({
+        "threshold": threshold,
+        "detector": detector,
+        "pyramid": scale,
+        "resolution": "{}x{}".format(*size),
+        "frames": len(latencies),
+        "offsets": found,
+        "fps": len(latencies) / (latencies.sum() / 1000) if len(latencies) else 0,
+        "latency_ms": {"p{}".format(p): float(np.percentile(latencies, p)) if len(latencies) else 0 for p in (50, 95, 99)},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def wait(process, results):
+    # the result of a combination, None once its process has died without
+    # putting one
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # whatever it put before exiting is already in the pipe
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    return None
+
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    # parse arguments
+    ap = argparse.ArgumentParser(description="benchmark the detection pipeline on recorded video")
+    ap.add_argument("clips", nargs="+", help="video files, folders or globs to replay")
+    ap.add_argument("-o", "--output", default="bench.json", help="write the results to this json file")
+    ap.add_argument("-j", "--config", default=ROBOT_CONFIG, help="vision chain config to run, the robot's by default")
+    ap.add_argument("-t", "--thresholds", default="hsv,lut", help="comma separated threshold engines")
+    ap.add_argument("-d", "--detectors", default="contours,components,pairs,projections", help="comma separated detection backends")
+    ap.add_argument("-y", "--pyramid", default="0", help="comma separated pyramid scales, 0 is off")
+    ap.add_argument("-r", "--resolutions", default="640x480,320x240", help="comma separated WxH to process at")
+    ap.add_argument("-l", "--lower", nargs="+", type=int, default=[113, 0, 197], help="HSV lower bounds")
+    ap.add_argument("-u", "--upper", nargs="+", type=int, default=[157, 10, 255], help="HSV upper bounds")
+    ap.add_argument("-n", "--num_frames", type=int, default=0, help="only use this many frames of each clip")
+    args = vars(ap.parse_args())
+
+    thresholds = args["thresholds"].split(",")
+    detectors = args["detectors"].split(",")
+    for name in thresholds:
+        if name not in THRESHOLDS:
+            ap.error("unknown threshold engine {}, choose from {}".format(name, ", ".join(sorted(THRESHOLDS))))
+    for name in detectors:
+        if name not in detect.DETECTORS:
+            ap.error("unknown detector {}, choose from {}".format(name, ", ".join(sorted(detect.DETECTORS))))
+
+    try:
+        config = chain.load(args["config"])
+        chain.stages(config)
+    except (IOError, KeyError, ValueError) as e:
+        ap.error("{}: {}".format(args["config"], e))
+
+    clips = find_clips(args["clips"])
+    if not clips:
+        sys.exit("No clips found")
+
+    bounds = Bounds(0, tuple(args["lower"]), tuple(args["upper"]))
+    sizes = [tuple(int(v) for v in r.split("x")) for r in args["resolutions"].split(",")]
+    scales = [int(scale) for scale in args["pyramid"].split(",")]
+
+    # run the combinations one after another so they do not compete for cores,
+    # one that fails is reported and left out
+    report = []
+    results = mp.Queue()
+    for size, threshold, detector, scale in combinations(sizes, thresholds, detectors, scales):
+        process = mp.Process(target=run, args=(clips, config, size, threshold, detector, scale, bounds, args["num_frames"], results))
+        process.start()
+        result = wait(process, results)
+        process.join()
+        if result is None:
+            print("{:>9} {:>4} {:>10} pyramid {}: failed with exit code {}".format(
+                "{}x{}".format(*size), threshold, detector, scale, process.exitcode))
+            continue
+        report.append(result)
+
+        print("{resolution:>9} {threshold:>4} {detector:>10} pyramid {pyramid}: {fps:8.1f} fps, "
+              "p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms, rss {peak_rss_mb:.0f} MB".format(**result, **result["latency_ms"]))
+
+    with open(args["output"], "w") as f:
+        json.dump({
+            "commit": commit(),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "config": args["config"],
+            "clips": clips,
+            "results": report,
+        }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# hsv bounds from the dashboard
+#
+# an entry listener on the table keeps an immutable copy of the bounds up to
+# date, so the vision loop only reads a local reference instead of making six
+# networktables calls per frame; the version goes up every time a bound
+# changes so anything built from the bounds can tell when to rebuild
+
+import collections
+import threading
+
+Bounds = collections.namedtuple("Bounds", ["version", "lower", "upper"])
+
+# dashboard keys with their defaults, in (h, s, v) order
+LOWER_KEYS = (("H-Lower", 0), ("S-Lower", 0), ("V-Lower", 0))
+UPPER_KEYS = (("H-Upper", 180), ("S-Upper", 255), ("V-Upper", 255))
+
+
+class BoundsCache:
+    def __init__(self, table):
+        self.lock = threading.Lock()
+        self.values = dict(LOWER_KEYS + UPPER_KEYS)
+        self.current = self.build(0)
+
+        # immediate notify fills in the values already on the table
+        table.addEntryListener(self.changed, immediateNotify=True)
+
+    def build(self, version):
+        lower = tuple(self.values[key] for key, default in LOWER_KEYS)
+        upper = tuple(self.values[key] for key, default in UPPER_KEYS)
+        return Bounds(version, lower, upper)
+
+    def changed(self, table, key, value, isNew):
+        # called on the networktables thread
+        if key not in self.values or self.values[key] == value:
+            return
+
+        with self.lock:
+            self.values[key] = value
+            self.current = self.build(self.current.version + 1)
+
+
+class PerVersion:
+    # rebuilds something derived from the bounds only when their version changes
+    def __init__(self, build):
+        self.build = build
+        self.version = None
+        self.value = None
+
+    def get(self, bounds):
+        if bounds.version != self.version:
+            self.value = self.build(bounds)
+            self.version = bounds.version
+        return self.value
@@ -0,0 +1,71 @@
+# persistent frame buffers
+#
+# every stage of the frame path writes into images that are allocated once,
+# so the steady state of the vision loop allocates nothing frame sized
+
+import collections
+import logging
+import threading
+import tracemalloc
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class Scratch:
+    # a persistent image that hands out views of the size asked for and only
+    # grows when a bigger one is needed, so windows of changing size reuse it
+    def __init__(self, channels=1, dtype=np.uint8):
+        self.channels = channels
+        self.dtype = dtype
+        self.image = None
+
+    def get(self, height, width):
+        if self.image is None or self.image.shape[0] < height or self.image.shape[1] < width:
+            shape = (height, width) if self.channels == 1 else (height, width, self.channels)
+            self.image = np.empty(shape, dtype=self.dtype)
+        return self.image[:height, :width]
+
+
+class BufferPool:
+    # a fixed set of images handed between stages, whoever acquires one
+    # releases it once it is done so no two stages ever share one
+    def __init__(self, shape, count, dtype=np.uint8):
+        self.lock = threading.Lock()
+        self.free = collections.deque(np.empty(shape, dtype=dtype) for i in range(count))
+
+    def acquire(self):
+        # None when every buffer is in use
+        with self.lock:
+            return self.free.popleft() if self.free else None
+
+    def release(self, image):
+        with self.lock:
+            self.free.append(image)
+
+
+class AllocationCounter:
+    # traces python and numpy allocations to show how many bytes each frame
+    # allocates on top of what is already held, tracing is slow so this is
+    # only for checking the steady state
+    def __init__(self, every=100):
+        self.every = every
+        self.frames = 0
+        self.peak = 0
+        self.total = 0
+        tracemalloc.start()
+
+    def frame_start(self):
+        tracemalloc.reset_peak()
+        self.held = tracemalloc.get_traced_memory()[0]
+
+    def frame_end(self):
+        allocated = tracemalloc.get_traced_memory()[1] - self.held
+        self.frames += 1
+        self.total += allocated
+        self.peak = max(self.peak, allocated)
+
+        if self.frames % self.every == 0:
+            log.info("allocated per frame: mean {:.0f} bytes, peak {} bytes".format(self.total / self.every, self.peak))
+            self.total = self.peak = 0
@@ -0,0 +1,180 @@
+# several cameras in one vision process
+#
+# every camera has its own source, bounds table and output key, but they all
+# share the one vision loop or worker pool, a process per camera would double
+# the memory and fight over the pi's cores. the scheduler hands vision the
+# newest frame of the camera the robot says is active before any other and
+# only lets the others through a few times a second, so the camera the driver
+# is lining up with gets the frame rate
+
+import collections
+import threading
+import time
+
+# the dashboard key the robot puts the name of the active camera under
+ACTIVE_KEY = "ActiveCamera"
+
+# table is the subtable of the dashboard its bounds are read from, "" for the
+# dashboard itself, and key is what its offsets are published under
+Camera = collections.namedtuple("Camera", ["name", "source", "table", "key"])
+
+
+def parse_camera(spec):
+    # name,source[,bounds table[,output key]]; the bounds table defaults to
+    # the name and the output key to <name>Offset
+    fields = spec.split(",")
+    if len(fields) < 2 or len(fields) > 4 or not fields[0] or not fields[1]:
+        raise ValueError("expected name,source[,bounds table[,output key]] but got {}".format(spec))
+
+    name, source = fields[:2]
+    table = fields[2] if len(fields) > 2 else name
+    key = fields[3] if len(fields) > 3 else name + "Offset"
+    return Camera(name, source, table, key)
+
+
+class Feed:
+    # the outbox of one camera's capture stage, wait holds every frame back
+    # until the one before it was taken
+    def __init__(self, scheduler, index, wait=False):
+        self.scheduler = scheduler
+        self.index = index
+        self.wait = wait
+
+    def put(self, item):
+        self.scheduler.put(self.index, item, self.wait)
+
+    def close(self):
+        self.scheduler.close(self.index)
+
+
+class Scheduler:
+    # keeps the newest frame of every camera and decides whose goes next; the
+    # active camera goes first except when another is due one of its
+    # background frames a second, with no active camera they take turns.
+    # on_drop is called with every frame pushed out unused; a file hands out
+    # every frame so its feed waits instead of pushing one out
+    def __init__(self, names, background=5, on_drop=None):
+        self.names = list(names)
+        self.interval = 1 / background if background > 0 else None
+        self.on_drop = on_drop
+        self.ready = threading.Condition()
+        self.newest = [None] * len(self.names)
+        self.served = [0] * len(self.names)
+        self.open = set(range(len(self.names)))
+        self.active = None
+        self.turn = 0
+        self.dropped = 0
+
+    @property
+    def closed(self):
+        return not self.open
+
+    def watch(self, table):
+        # follow the active camera the robot puts on the table
+        table.addEntryListener(self.changed, immediateNotify=True)
+
+    def changed(self, table, key, value, isNew):
+        # called on the networktables thread
+        if key != ACTIVE_KEY:
+            return
+
+        with self.ready:
+            self.active = self.names.index(value) if value in self.names else None
+            self.ready.notify_all()
+
+    def shown(self):
+        # the camera the dashboard streams show
+        active = self.active
+        return active if active is not None else 0
+
+    def feed(self, index, wait=False):
+        return Feed(self, index, wait)
+
+    def put(self, index, item, wait=False):
+        # with wait the frame is held back until the last one of its camera
+        # was taken, it is only let go if the camera is closed meanwhile
+        with self.ready:
+            if wait:
+                self.ready.wait_for(lambda: self.newest[index] is None or index not in self.open)
+                if index not in self.open:
+                    oldest, item = item, None
+            if item is not None:
+                oldest = self.newest[index]
+                self.newest[index] = item
+                if oldest is not None:
+                    self.dropped += 1
+            self.ready.notify_all()
+
+        if oldest is not None and self.on_drop is not None:
+            self.on_drop(oldest)
+
+    def pick(self, now):
+        # the camera to serve now, or None and how long until one may be
+        active = self.active if len(self.names) > 1 else None
+        wait = None
+        for i in range(len(self.names)):
+            index = (self.turn + i) % len(self.names)
+            if self.newest[index] is None:
+                continue
+            if active is None:
+                return index, None
+            if index == active or self.interval is None:
+                continue
+
+            due = self.served[index] + self.interval - now
+            if due <= 0:
+                return index, None
+            wait = due if wait is None else min(wait, due)
+
+        if active is not None and self.newest[active] is not None:
+            return active, None
+        return None, wait
+
+    def get(self, timeout=None):
+        # the next frame to run vision on, or None on timeout or once every
+        # camera is closed
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.ready:
+            while True:
+                now = time.monotonic()
+                index, wait = self.pick(now)
+                if index is not None:
+                    item = self.newest[index]
+                    self.newest[index] = None
+                    self.served[index] = now
+                    self.turn = index + 1
+                    self.ready.notify_all()
+                    return item
+
+                if not self.open:
+                    return None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.ready.wait(wait)
+
+    def close(self, index=None):
+        # close one camera's feed, or all of them
+        with self.ready:
+            if index is None:
+                self.open.clear()
+            else:
+                self.open.discard(index)
+            self.ready.notify_all()
+
+
+class CameraState:
+    # what vision keeps for each camera: where its frames come from, its
+    # bounds, vision chain, tracker and filter, where its offsets go and the
+    # last targets it saw on each side
+    def __init__(self, index, camera, source, cache, chain, publisher, tracker=None, predictor=None):
+        self.index = index
+        self.camera = camera
+        self.source = source
+        self.cache = cache
+        self.chain = chain
+        self.publisher = publisher
+        self.tracker = tracker
+        self.predictor = predictor
+        self.lX = self.lY = self.rX = self.rY = 0
@@ -0,0 +1,188 @@
+# declarative vision chain
+#
+# the stages a frame goes through and their parameters are declared in a json
+# file next to each script and compiled once into a chain: kernels are built
+# up front, erode and dilate become a single morphologyEx opening, stages
+# that would do nothing are left out and the scratch images are allocated at
+# the frame size, so every script runs the same code and a speed up made
+# here lands in all of them. a config looks like
+#
+#   {"width": 600, "height": 0, "distance_between_targets": 11.5,
+#    "stages": [{"stage": "blur", "kernel": 11},
+#               {"stage": "threshold", "engine": "hsv", "lower": [113, 0, 197], "upper": [157, 10, 255]},
+#               {"stage": "open", "iterations": 2},
+#               {"stage": "detect", "backend": "contours", "min_area": 100}]}
+#
+# the frame sources deliver frames at width and height, a height of 0 keeps
+# the aspect ratio of the source; without lower and upper the bounds are
+# passed in with every frame, usually from the dashboard. the benchmark,
+# sweep, batch and tune tools run the same chains, and the pyramid and the
+# governor start from the blur and opening a chain declares
+
+import json
+import os
+
+import cv2
+
+from hatchvision import detect
+from hatchvision.bounds import Bounds
+from hatchvision.buffers import Scratch
+from hatchvision.threshold import THRESHOLDS
+from hatchvision.timing import NO_TIMINGS
+
+# the stages in the order they run with their parameters and defaults,
+# threshold and detect are required
+STAGES = (("blur", {"kernel": 0}),
+          ("threshold", {"engine": "hsv", "lower": None, "upper": None}),
+          ("open", {"iterations": 0}),
+          ("detect", {"backend": "contours", "min_area": 100}))
+REQUIRED = ("threshold", "detect")
+
+
+def config_path(script):
+    # the config shipped next to a script, hatchalign.py reads hatchalign.json
+    return os.path.splitext(os.path.abspath(script))[0] + ".json"
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def stages(config):
+    # the parameters of every stage with the defaults filled in, None for a
+    # stage the config leaves out; raises ValueError for anything it does
+    # not know, stages out of order or values the stages cannot run with
+    order = [name for name, defaults in STAGES]
+    declared = [stage.get("stage") for stage in config.get("stages", [])]
+    for name in declared:
+        if name not in order:
+            raise ValueError("unknown stage {}".format(name))
+    if declared != sorted(set(declared), key=order.index):
+        raise ValueError("stages must run in the order {} and appear once".format(", ".join(order)))
+    for name in REQUIRED:
+        if name not in declared:
+            raise ValueError("the {} stage is required".format(name))
+
+    params = {}
+    for name, defaults in STAGES:
+        params[name] = None
+        for stage in config["stages"]:
+            if stage["stage"] == name:
+                unknown = set(stage) - set(defaults) - {"stage"}
+                if unknown:
+                    raise ValueError("unknown {} parameters {}".format(name, ", ".join(sorted(unknown))))
+                params[name] = dict(defaults, **{key: value for key, value in stage.items() if key != "stage"})
+
+    # checked here so a bad value is a ValueError before any frame, not a
+    # KeyError or cv2.error out of the first one
+    if params["threshold"]["engine"] not in THRESHOLDS:
+        raise ValueError("unknown threshold engine {}, one of {}".format(
+            params["threshold"]["engine"], ", ".join(sorted(THRESHOLDS))))
+    if params["detect"]["backend"] not in detect.DETECTORS:
+        raise ValueError("unknown detect backend {}, one of {}".format(
+            params["detect"]["backend"], ", ".join(sorted(detect.DETECTORS))))
+    if params["blur"] is not None:
+        kernel = params["blur"]["kernel"]
+        if not isinstance(kernel, int) or kernel < 0 or (kernel > 1 and kernel % 2 == 0):
+            raise ValueError("the blur kernel must be odd or 0 to leave it out, not {}".format(kernel))
+    if params["open"] is not None:
+        iterations = params["open"]["iterations"]
+        if not isinstance(iterations, int) or iterations < 0:
+            raise ValueError("open iterations must be 0 or more, not {}".format(iterations))
+    return params
+
+
+def override(config, width=None, height=None, engine=None, lower=None, upper=None, backend=None,
+             blur=None, iterations=None):
+    # command line options win over the file, None leaves a value alone and
+    # a stage the file leaves out is added for a value given for it
+    for key, value in (("width", width), ("height", height)):
+        if value is not None:
+            config[key] = value
+
+    order = [name for name, defaults in STAGES]
+    for name, values in (("blur", {"kernel": blur}),
+                         ("threshold", {"engine": engine, "lower": lower, "upper": upper}),
+                         ("open", {"iterations": iterations}),
+                         ("detect", {"backend": backend})):
+        values = {key: value for key, value in values.items() if value is not None}
+        if not values:
+            continue
+
+        declared = [stage for stage in config.setdefault("stages", []) if stage.get("stage") == name]
+        if not declared:
+            declared = [{"stage": name}]
+            config["stages"].append(declared[0])
+            config["stages"].sort(key=lambda stage: order.index(stage["stage"]) if stage.get("stage") in order else len(order))
+        for stage in declared:
+            stage.update(values)
+    return config
+
+
+def declare(engine="hsv", backend="contours", blur=0, iterations=2, width=640, height=480):
+    # a config for settings given one by one, for the tools that try them
+    return override({"width": width, "height": height, "stages": []}, engine=engine, backend=backend,
+                    blur=blur, iterations=iterations)
+
+
+class VisionChain:
+    # size is the (width, height) of the frames when the source has settled
+    # it, otherwise the configured size is used
+    def __init__(self, config, size=None, timings=NO_TIMINGS):
+        params = stages(config)
+        self.width, self.height = size or (config["width"], config.get("height", 0))
+        self.centerX = self.width // 2
+        self.distance_between_targets = config.get("distance_between_targets", 11.5)
+        self.timings = timings
+
+        # a blur of 1 or less and an opening of no passes are left out
+        kernel = params["blur"]["kernel"] if params["blur"] else 0
+        self.blur = (kernel, kernel) if kernel > 1 else None
+        self.iterations = params["open"]["iterations"] if params["open"] else 0
+        self.opening = detect.opening(self.iterations) if self.iterations > 0 else None
+
+        threshold = params["threshold"]
+        self.threshold = THRESHOLDS[threshold["engine"]](timings)
+        self.bounds = None
+        if threshold["lower"] is not None and threshold["upper"] is not None:
+            self.bounds = Bounds(0, tuple(threshold["lower"]), tuple(threshold["upper"]))
+
+        self.detector = detect.DETECTORS[params["detect"]["backend"]]
+        self.min_area = params["detect"]["min_area"]
+
+        # scratch images at the frame size, windows into the frame use views
+        self.blurred = Scratch(3)
+        self.mask = Scratch(1)
+        if self.height > 0:
+            if self.blur is not None:
+                self.blurred.get(self.height, self.width)
+            self.mask.get(self.height, self.width)
+
+    def __call__(self, frame, bounds=None, offset=(0, 0), mask=None):
+        # the mask and the candidates with the left and right target for a
+        # frame, or a window into one at offset; the mask is written into
+        # mask when it is given and the configured bounds are used without
+        # bounds
+        height, width = frame.shape[:2]
+        if mask is None:
+            mask = self.mask.get(height, width)
+
+        if self.blur is not None:
+            tick = self.timings.start()
+            frame = cv2.GaussianBlur(frame, self.blur, 0, dst=self.blurred.get(height, width))
+            self.timings.lap("blur", tick)
+
+        self.threshold(frame, bounds if bounds is not None else self.bounds, dst=mask)
+
+        if self.opening is not None:
+            tick = self.timings.start()
+            cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.opening, dst=mask)
+            self.timings.lap("morphology", tick)
+
+        candidates, left, right = self.detector(mask, self.centerX, self.width, self.min_area, offset, self.timings)
+        return mask, candidates, left, right
+
+    def offset_from_center(self, lX, rX):
+        # raises ValueError when centerX is not between the targets
+        return detect.offset_from_center(lX, rX, self.centerX, self.distance_between_targets)
@@ -0,0 +1,352 @@
+# target detection shared by the vision scripts
+
+import collections
+import threading
+
+import cv2
+import imutils
+import numpy as np
+
+from hatchvision.buffers import Scratch
+from hatchvision.timing import NO_TIMINGS
+
+# a detected blob as the circle drawn around it, the offset is computed from x
+Target = collections.namedtuple("Target", ["x", "y", "radius"])
+
+# opening kernels by the number of passes, built once
+OPENINGS = {}
+
+# the label image of the component backends, kept per thread and reused
+# across frames; the stats and centroids are a row per blob and stay small
+SCRATCH = threading.local()
+
+
+def opening(iterations):
+    # n passes of the 3x3 kernel erode and dilate exactly like one pass of a
+    # 2n + 1 square, so an opening is a single morphologyEx call
+    kernel = OPENINGS.get(iterations)
+    if kernel is None:
+        size = 2 * iterations + 1
+        kernel = OPENINGS.setdefault(iterations, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+    return kernel
+
+
+def clean(mask, iterations=2, dst=None):
+    # open the mask to drop specks of noise, the same as eroding then dilating
+    # it iterations times; dst can be mask itself to clean it in place
+    if iterations > 0:
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, opening(iterations), dst=dst)
+    return mask
+
+
+def find_contours(mask, offset=(0, 0)):
+    # offset shifts the contours when mask is a window into a larger frame,
+    # findContours has left its input alone since opencv 3.2 so no copy
+    cnts = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+    return imutils.grab_contours(cnts)
+
+
+def nearest_contours(cnts, centerX, width, min_area):
+    # find closest contours to center on each side, returns the contours
+    # larger than min_area along with the nearest left and right ones
+    min_left = 0
+    min_right = width
+    left_contour = None
+    right_contour = None
+    candidates = []
+
+    for c in cnts:
+        area = cv2.contourArea(c)
+
+        # look only at contours larger than the min_area
+        if area > min_area:
+            M = cv2.moments(c)
+            cX = int((M["m10"] / M["m00"]))
+            candidates.append(c)
+
+            # find the contours closest to the center x-value of the frame
+            if cX > centerX:
+                if cX < min_right:
+                    min_right = cX
+                    right_contour = c
+            else:
+                if cX > min_left:
+                    min_left = cX
+                    left_contour = c
+
+    return candidates, left_contour, right_contour
+
+
+def enclosing(c):
+    # the target for a contour, None stays None
+    if c is None:
+        return None
+
+    ((x, y), radius) = cv2.minEnclosingCircle(c)
+    return Target(x, y, radius)
+
+
+def find_targets(mask, centerX, width, min_area, offset=(0, 0), timings=NO_TIMINGS):
+    # the targets for the contours larger than min_area along with the
+    # nearest target on the left and on the right of centerX
+    tick = timings.start()
+    cnts = find_contours(mask, offset)
+    tick = timings.lap("contours", tick)
+
+    candidates, left_contour, right_contour = nearest_contours(cnts, centerX, width, min_area)
+    targets = [enclosing(c) for c in candidates], enclosing(left_contour), enclosing(right_contour)
+    timings.lap("selection", tick)
+    return targets
+
+
+def label_target(labels, stats, label, offset=(0, 0)):
+    # the target for a labelled blob, the same enclosing circle as the
+    # contour path taken from the outline of the blob inside its bounding
+    # box; the circle only depends on the outline and fitting it to every
+    # pixel of a near target made this the slowest part of the backend
+    bx, by, bw, bh = stats[:4]
+    patch = (labels[by:by + bh, bx:bx + bw] == label).view(np.uint8)
+    cnts = imutils.grab_contours(cv2.findContours(patch, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE))
+    ((cx, cy), r) = cv2.minEnclosingCircle(max(cnts, key=len))
+    return Target(cx + bx + offset[0], cy + by + offset[1], r)
+
+
+def kept_components(mask, min_area, offset=(0, 0)):
+    # the labels of the blobs larger than min_area with their stats, the
+    # candidates as an (n, 3) array of x, y, radius rows and the label image,
+    # which is only good until the next call on the same thread
+    if not hasattr(SCRATCH, "labels"):
+        SCRATCH.labels = Scratch(1, np.int32)
+    labels = SCRATCH.labels.get(*mask.shape[:2])
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, labels, connectivity=8)
+
+    # label 0 is the background, then look only at blobs larger than min_area
+    kept = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] > min_area) + 1
+    x = centroids[kept, 0] + offset[0]
+    y = centroids[kept, 1] + offset[1]
+    radius = np.hypot(stats[kept, cv2.CC_STAT_WIDTH], stats[kept, cv2.CC_STAT_HEIGHT]) / 2
+    return count, labels, kept, stats[kept], np.column_stack((x, y, radius))
+
+
+def nearest_components(labels, kept, stats, candidates, centerX, width, offset=(0, 0)):
+    # the nearest blobs on each side of centerX, compared on whole pixels
+    # like the contour path
+    cX = candidates[:, 0].astype(np.int64)
+    right = np.flatnonzero((cX > centerX) & (cX < width))
+    left = np.flatnonzero((cX <= centerX) & (cX > 0))
+
+    def target(i):
+        return label_target(labels, stats[i], kept[i], offset)
+
+    left_target = target(left[np.argmax(cX[left])]) if len(left) else None
+    right_target = target(right[np.argmin(cX[right])]) if len(right) else None
+    return left_target, right_target
+
+
+def find_components(mask, centerX, width, min_area, offset=(0, 0), timings=NO_TIMINGS):
+    # same as find_targets but from connected component stats, the filter and
+    # the nearest selection work on whole arrays instead of looping per blob;
+    # the candidates come back as an (n, 3) array of x, y, radius rows
+    tick = timings.start()
+    count, labels, kept, stats, candidates = kept_components(mask, min_area, offset)
+    tick = timings.lap("contours", tick)
+
+    left, right = nearest_components(labels, kept, stats, candidates, centerX, width, offset)
+    timings.lap("selection", tick)
+    return candidates, left, right
+
+
+# what a real pair of tape strips looks like: the centres are this many strip
+# lengths apart, each strip is this many times longer than wide and leans
+# this many degrees towards the other one
+PAIR_SPACING = 11.5 / 5.5
+TAPE_ASPECT = 5.5 / 2
+TAPE_TILT = 14.5
+
+# pairs scoring worse than this are not taken for a target, tilt counts for
+# less than the rest because small blobs only give a rough angle
+MAX_PAIR_SCORE = 2.0
+TILT_WEIGHT = 0.5
+
+
+def blob_features(labels, count, kept, offset=(0, 0)):
+    # area, centroid, tilt, aspect and length of every kept label at once,
+    # from the second moments of their pixels; tilt is the lean of the long
+    # axis from vertical in degrees, positive when the top leans right, which
+    # for a filled strip is the angle minAreaRect gives
+    remap = np.zeros(count, dtype=np.intp)
+    remap[kept] = np.arange(1, len(kept) + 1)
+    ys, xs = np.nonzero(labels)
+    index = remap[labels[ys, xs]]
+    xs = xs.astype(np.float64)
+    ys = ys.astype(np.float64)
+
+    def total(weights=None):
+        return np.bincount(index, weights, len(kept) + 1)[1:]
+
+    area = total()
+    x = total(xs) / area
+    y = total(ys) / area
+    mu20 = total(xs * xs) / area - x * x
+    mu02 = total(ys * ys) / area - y * y
+    mu11 = total(xs * ys) / area - x * y
+
+    # the long and short axis variances, a filled strip of length l has l^2/12
+    spread = np.hypot((mu20 - mu02) / 2, mu11)
+    major = (mu20 + mu02) / 2 + spread
+    minor = np.maximum((mu20 + mu02) / 2 - spread, 1 / 12)
+
+    # the long axis turned to point up the image, y is down
+    theta = np.arctan2(2 * mu11, mu20 - mu02) / 2
+    ux, uy = np.cos(theta), np.sin(theta)
+    down = uy > 0
+    ux[down], uy[down] = -ux[down], -uy[down]
+    tilt = np.degrees(np.arctan2(ux, -uy))
+
+    return area, x + offset[0], y + offset[1], tilt, np.sqrt(major / minor), np.sqrt(12 * major)
+
+
+def score_pairs(area, x, y, tilt, aspect, length, centerX):
+    # score every blob i as the left strip against every blob j as the right
+    # one in one go, lower is better; a real pair is as far apart as its
+    # strips are long, leans in, is the same size and shape, level and around
+    # centerX. pairs where i is not left of j score inf
+    left, right = np.s_[:, np.newaxis], np.s_[np.newaxis, :]
+    dx = x[right] - x[left]
+    size = (length[left] + length[right]) / 2
+
+    spacing = np.abs(dx / size - PAIR_SPACING) / PAIR_SPACING
+    lean = (np.abs(tilt[left] - TAPE_TILT) + np.abs(tilt[right] + TAPE_TILT)) / (2 * TAPE_TILT)
+    similar = np.abs(np.log(area[left] / area[right]))
+    shape = np.abs(np.log(aspect / TAPE_ASPECT))
+    shape = (shape[left] + shape[right]) / 2
+    level = np.abs(y[left] - y[right]) / size
+    centred = np.abs((x[left] + x[right]) / 2 - centerX) / np.maximum(dx, 1)
+
+    score = spacing + TILT_WEIGHT * lean + similar + shape + level + centred
+    score[dx <= 0] = np.inf
+    return score
+
+
+def find_pairs(mask, centerX, width, min_area, offset=(0, 0), timings=NO_TIMINGS):
+    # the best scoring left and right pair of blobs instead of the nearest
+    # blob on each side, so two targets in view are never mixed up; falls
+    # back to the nearest blobs when no pair looks like a target
+    tick = timings.start()
+    count, labels, kept, stats, candidates = kept_components(mask, min_area, offset)
+    tick = timings.lap("contours", tick)
+
+    if len(kept) > 1:
+        score = score_pairs(*blob_features(labels, count, kept, offset), centerX)
+        i, j = np.unravel_index(np.argmin(score), score.shape)
+        if score[i, j] <= MAX_PAIR_SCORE:
+            left = label_target(labels, stats[i], kept[i], offset)
+            right = label_target(labels, stats[j], kept[j], offset)
+            timings.lap("selection", tick)
+            return candidates, left, right
+
+    left, right = nearest_components(labels, kept, stats, candidates, centerX, width, offset)
+    timings.lap("selection", tick)
+    return candidates, left, right
+
+
+# a row band with at least this share of the pixels of the busiest one means
+# blobs at different heights, which the projection cannot tell apart
+AMBIGUOUS_BAND = 0.25
+
+
+def runs(occupied):
+    # the start and the end, exclusive, of every run of True
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], occupied.view(np.int8), [0]))))
+    return edges[0::2], edges[1::2]
+
+
+def find_projections(mask, centerX, width, min_area, offset=(0, 0), timings=NO_TIMINGS):
+    # the strips from the column sums of the mask over the band of rows they
+    # occupy instead of tracing contours, each run of columns is a blob and
+    # its weighted column sum gives a sub-pixel x; falls back to the contour
+    # path when the projection is ambiguous, with blobs at different heights,
+    # blobs stacked in the same columns or a blob wider than the band is tall
+    tick = timings.start()
+    rows = mask.sum(axis=1, dtype=np.int32) // 255
+    starts, ends = runs(rows > 0)
+    if len(starts) == 0:
+        timings.lap("contours", tick)
+        return [], None, None
+
+    # the busiest run of rows is the band the strips are in
+    pixels = np.add.reduceat(rows, starts)
+    best = np.argmax(pixels)
+    if np.count_nonzero(pixels >= pixels[best] * AMBIGUOUS_BAND) > 1:
+        return find_targets(mask, centerX, width, min_area, offset, timings)
+    top, bottom = starts[best], ends[best]
+    band = mask[top:bottom]
+
+    # every run of columns larger than min_area is a candidate
+    columns = band.sum(axis=0, dtype=np.int32) // 255
+    starts, ends = runs(columns > 0)
+    area = np.add.reduceat(columns, starts)
+    moment = np.add.reduceat(columns * np.arange(len(columns)), starts)
+    kept = area > min_area
+    starts, ends, area, moment = starts[kept], ends[kept], area[kept], moment[kept]
+    if np.any(ends - starts > bottom - top):
+        return find_targets(mask, centerX, width, min_area, offset, timings)
+
+    # blobs stacked in the same columns leave a gap in the rows of their run
+    profiles = [band[:, start:end].sum(axis=1, dtype=np.int32) // 255 for start, end in zip(starts, ends)]
+    if any(len(runs(profile > 0)[0]) > 1 for profile in profiles):
+        return find_targets(mask, centerX, width, min_area, offset, timings)
+    tick = timings.lap("contours", tick)
+
+    x = moment / area + offset[0]
+    radius = np.hypot(ends - starts, bottom - top) / 2
+    candidates = np.column_stack((x, np.full(len(x), offset[1] + (top + bottom - 1) / 2), radius))
+
+    # the nearest peaks, compared on whole pixels like the contour path, get
+    # their y from the rows of their own columns
+    def target(i):
+        profile = profiles[i]
+        filled = np.flatnonzero(profile)
+        y = np.dot(profile, np.arange(len(profile))) / area[i]
+        return Target(x[i], offset[1] + top + y, np.hypot(ends[i] - starts[i], filled[-1] - filled[0] + 1) / 2)
+
+    cX = x.astype(np.int64)
+    right = np.flatnonzero((cX > centerX) & (cX < width))
+    left = np.flatnonzero((cX <= centerX) & (cX > 0))
+    left_target = target(left[np.argmax(cX[left])]) if len(left) else None
+    right_target = target(right[np.argmin(cX[right])]) if len(right) else None
+    timings.lap("selection", tick)
+
+    return candidates, left_target, right_target
+
+
+# detection backends, each takes a mask and returns the candidates along with
+# the left and right target, the nearest on either side of centerX or the
+# best scoring pair; contours is the default, the others are opt in until
+# the bench on the pi shows them beating it. components and pairs label every
+# pixel of the frame, so on a sparse mask they cost many times what contours
+# does
+DETECTORS = {"contours": find_targets, "components": find_components, "pairs": find_pairs,
+             "projections": find_projections}
+
+
+def offset_from_center(lX, rX, centerX, distance_between_targets):
+    # interpolate the distance between the centers of the two nearest contours,
+    # raises ValueError when centerX is not between them like interp1d did;
+    # a straight line through two points needs no scipy
+    if not min(lX, rX) <= centerX <= max(lX, rX) or lX == rX:
+        raise ValueError("{} is not between the targets at {} and {}".format(centerX, lX, rX))
+    distance_from_left = (centerX - lX) / (rX - lX) * distance_between_targets
+    return (distance_between_targets / 2) - float(distance_from_left)
+
+
+def draw_targets(frame, candidates, left, right):
+    # draw a blue circle around every target
+    for x, y, radius in candidates:
+        cv2.circle(frame, (int(x), int(y)), int(radius), (255, 255, 0), 1)
+
+    # draw a yellow circle around the nearest targets
+    for target in (left, right):
+        if target is not None:
+            x, y, radius = target
+            cv2.circle(frame, (int(x), int(y)), int(radius), (0, 255, 255), 1)
@@ -0,0 +1,76 @@
+# frame display for the driver station scripts
+#
+# the vision loop hands a copy of its newest frame, with what it found on it,
+# to a single slot mailbox and returns straight away; a thread of its own
+# draws on the copy and shows it at a capped refresh rate, so repainting the
+# window never holds up the offset. the window is only ever touched from that
+# thread, which also notices 'q' and sets stopped for the loop to check
+
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from hatchvision.buffers import BufferPool
+from hatchvision.pipeline import LatestQueue
+
+log = logging.getLogger(__name__)
+
+
+class Display:
+    # draw is called on the display thread with the copy of the frame and
+    # whatever else was put with it, fps caps how often the window repaints
+    def __init__(self, draw, name="Frame:", fps=30):
+        self.draw = draw
+        self.name = name
+        self.interval = 1 / fps if fps > 0 else 0
+        self.buffers = None
+        self.mailbox = LatestQueue(1, on_drop=lambda item: self.buffers.release(item[0]))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="display", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, frame, *annotations):
+        # copy the frame for the display thread, skipped while it still has
+        # every copy
+        if self.buffers is None:
+            self.buffers = BufferPool(frame.shape, 2, frame.dtype)
+
+        image = self.buffers.acquire()
+        if image is None:
+            return
+        np.copyto(image, frame)
+        self.mailbox.put((image,) + annotations)
+
+    def run(self):
+        while not self.stopped.is_set():
+            # keep the window responsive while waiting for a frame
+            item = self.mailbox.get(timeout=0.05)
+            started = time.monotonic()
+            if item is not None:
+                try:
+                    self.draw(*item)
+                    cv2.imshow(self.name, item[0])
+                except Exception:
+                    log.exception("display failed")
+                finally:
+                    self.buffers.release(item[0])
+
+            # poll the keyboard for the rest of the frame interval, so the
+            # window repaints at most fps times a second
+            wait = max(int((started + self.interval - time.monotonic()) * 1000), 1)
+            if cv2.waitKey(wait) & 0xFF == ord("q"):
+                self.stopped.set()
+
+        cv2.destroyAllWindows()
+
+    def stop(self):
+        self.stopped.set()
+        self.mailbox.close()
+        if self.thread.is_alive():
+            self.thread.join()
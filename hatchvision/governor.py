@@ -0,0 +1,147 @@
+# adaptive processing level
+#
+# the governor watches how long vision takes per frame against a latency
+# budget and steps down a ladder of cheaper settings, a smaller processing
+# resolution, no blur and less morphology, when the p90 of a window of frames
+# goes over it; it only steps back up after the p90 has stayed well under the
+# budget for a few windows in a row, so it does not flap between two levels
+# when a busy scene or a throttling pi sits right at the edge. the top of the
+# ladder is the vision chain exactly as the config declares it
+
+import collections
+import logging
+
+import cv2
+import numpy as np
+
+from hatchvision import detect
+from hatchvision.buffers import Scratch
+
+log = logging.getLogger(__name__)
+
+# scale divides the processing resolution, blur is the gaussian kernel size
+# and iterations the erode and dilate passes
+Level = collections.namedtuple("Level", ["scale", "blur", "iterations"])
+
+
+def declared(chain):
+    # the level of the chain as its config declares it
+    return Level(1, chain.blur[0] if chain.blur is not None else 0, chain.iterations)
+
+
+def ladder(chain):
+    # best first: the chain itself, then no blur, then half and quarter
+    # resolution with less morphology; a step that would repeat the one
+    # above is left out
+    levels = []
+    for level in (declared(chain), Level(1, 0, chain.iterations),
+                  Level(2, 0, chain.iterations // 2), Level(2, 0, 0), Level(4, 0, 0)):
+        if level not in levels:
+            levels.append(level)
+    return tuple(levels)
+
+
+class Governor:
+    # budget is in seconds, headroom the share of it the p90 must stay under
+    # for patience windows before a step up; table gets the level when given
+    def __init__(self, budget, levels, level=0, window=30, headroom=0.6, patience=2, table=None):
+        self.budget = budget
+        self.levels = levels
+        self.index = level
+        self.window = window
+        self.headroom = headroom
+        self.patience = patience
+        self.table = table
+        self.samples = []
+        self.calm = 0
+
+        # scratch images for the scaled paths
+        self.small = Scratch(3)
+        self.blurred = Scratch(3)
+        self.mask = Scratch(1)
+
+        self.publish()
+
+    @property
+    def level(self):
+        return self.levels[self.index]
+
+    def observe(self, seconds):
+        # record one frame's vision time, returns True when the level changed
+        self.samples.append(seconds)
+        if len(self.samples) < self.window:
+            return False
+
+        p90 = np.percentile(self.samples, 90)
+        self.samples = []
+
+        index = self.index
+        if p90 > self.budget:
+            self.calm = 0
+            index = min(self.index + 1, len(self.levels) - 1)
+        elif p90 < self.budget * self.headroom:
+            self.calm += 1
+            if self.calm >= self.patience:
+                self.calm = 0
+                index = max(self.index - 1, 0)
+        else:
+            self.calm = 0
+
+        if index == self.index:
+            return False
+
+        self.index = index
+        log.info("p90 vision time %.1f ms, governor level %d %s", p90 * 1000, index, self.level)
+        self.publish()
+        return True
+
+    def publish(self):
+        if self.table is not None:
+            level = self.level
+            self.table.putNumber("GovernorLevel", self.index)
+            self.table.putString("GovernorSetting", "1/{} blur {} morphology {}".format(level.scale, level.blur, level.iterations))
+
+    def find_targets(self, frame, chain, bounds, mask=None, offset=(0, 0)):
+        # the targets the chain finds at the current level, mask is where the
+        # full size mask goes and offset is where frame sits when it is a
+        # window into a larger frame; returns the mask the targets were found
+        # on with them
+        level = self.level
+        if level == declared(chain):
+            return chain(frame, bounds, offset, mask)
+
+        threshold, detector, timings = chain.threshold, chain.detector, chain.timings
+        centerX, min_area = chain.centerX, chain.min_area
+        height, width = frame.shape[:2]
+        scale = level.scale
+
+        if scale > 1:
+            height, width = max(height // scale, 1), max(width // scale, 1)
+            frame = cv2.resize(frame, (width, height), dst=self.small.get(height, width), interpolation=cv2.INTER_AREA)
+            mask = self.mask.get(height, width)
+
+        if level.blur > 1:
+            frame = cv2.GaussianBlur(frame, (level.blur, level.blur), 0, dst=self.blurred.get(height, width))
+
+        mask = threshold(frame, bounds, dst=mask)
+        tick = timings.start()
+        mask = detect.clean(mask, level.iterations, mask)
+        timings.lap("morphology", tick)
+
+        if scale == 1:
+            candidates, left, right = detector(mask, centerX, offset[0] + width, min_area, offset, timings)
+            return mask, candidates, left, right
+
+        # find them on the small mask, then put them back where they are in
+        # the full frame, a small pixel covers scale full ones
+        centre = (scale - 1) / 2
+        candidates, left, right = detector(mask, (centerX - offset[0] - centre) / scale, width,
+                                           min_area / (scale * scale), (0, 0), timings)
+
+        def full(target):
+            if target is None:
+                return None
+            x, y, radius = target
+            return detect.Target(offset[0] + x * scale + centre, offset[1] + y * scale + centre, radius * scale)
+
+        return mask, [full(target) for target in candidates], full(left), full(right)
@@ -0,0 +1,104 @@
+# staged frame pipeline
+#
+# each stage runs on its own worker thread and hands its output to the next
+# stage through a bounded queue that drops the oldest item when it is full,
+# so a slow stage never makes the stages before it work on stale frames
+
+import collections
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# a captured frame tagged with its sequence number, capture time and the
+# index of the camera it came from
+Frame = collections.namedtuple("Frame", ["seq", "timestamp", "image", "camera"], defaults=(0,))
+
+
+class LatestQueue:
+    # on_drop is called with every item that is pushed out unused, so
+    # buffers it holds can be handed back; with wait a full queue holds put
+    # back until there is room instead of dropping, for replays
+    def __init__(self, maxsize=1, on_drop=None, wait=False):
+        self.items = collections.deque(maxlen=maxsize)
+        self.ready = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.on_drop = on_drop
+        self.wait = wait
+
+    def put(self, item):
+        with self.ready:
+            if self.wait:
+                self.ready.wait_for(lambda: len(self.items) < self.items.maxlen or self.closed)
+            # the deque discards the oldest item itself, we only count it
+            oldest = None
+            if len(self.items) == self.items.maxlen:
+                oldest = self.items[0]
+                self.dropped += 1
+            self.items.append(item)
+            self.ready.notify_all()
+
+        if oldest is not None and self.on_drop is not None:
+            self.on_drop(oldest)
+
+    def get(self, timeout=None):
+        # return the oldest queued item, or None on timeout or once closed
+        with self.ready:
+            self.ready.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                return None
+            self.ready.notify_all()
+            return self.items.popleft()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+
+
+class Stage(threading.Thread):
+    # a stage without an inbox is a source and calls work() repeatedly until
+    # it raises StopIteration, otherwise work(item) is called for every item
+    # taken from the inbox; anything other than None that work returns goes
+    # to every outbox, which are closed when the stage ends
+    def __init__(self, name, work, inbox=None, outboxes=()):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.inbox = inbox
+        self.outboxes = outboxes
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.inbox is None:
+                item = self.call()
+            else:
+                item = self.inbox.get(timeout=0.1)
+                if item is None:
+                    if self.inbox.closed:
+                        break
+                    continue
+                item = self.call(item)
+
+            if item is not None:
+                for outbox in self.outboxes:
+                    outbox.put(item)
+
+        for outbox in self.outboxes:
+            outbox.close()
+
+    def call(self, *item):
+        # keep the worker alive if a single item fails
+        try:
+            return self.work(*item)
+        except StopIteration:
+            # a source that has run out
+            self.stopped.set()
+            return None
+        except Exception:
+            log.exception("stage %s failed", self.name)
+            return None
+
+    def stop(self):
+        self.stopped.set()
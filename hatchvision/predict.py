@@ -0,0 +1,83 @@
+# offsets between detections
+#
+# an alpha-beta filter follows each target's x with a constant velocity, so
+# jitter is smoothed and the offset can be predicted for any moment, not just
+# when a frame has been processed; a side that drops out keeps moving at its
+# last velocity instead of sitting still, and the confidence falls as the
+# newest detection of each side gets older
+
+import threading
+
+from hatchvision import detect
+
+
+class AlphaBeta:
+    # alpha is how far a measurement pulls the position, beta the velocity
+    def __init__(self, alpha=0.5, beta=0.1):
+        self.alpha = alpha
+        self.beta = beta
+        self.x = None
+        self.v = 0.0
+        self.t = None
+
+    def predict(self, t):
+        return self.x + self.v * (t - self.t)
+
+    def update(self, x, t):
+        if self.x is None:
+            self.x, self.t = x, t
+            return
+
+        dt = t - self.t
+        if dt <= 0:
+            # a frame captured before the last one, or at the same moment
+            return
+
+        predicted = self.predict(t)
+        residual = x - predicted
+        self.x = predicted + self.alpha * residual
+        self.v += self.beta * residual / dt
+        self.t = t
+
+    def reset(self):
+        self.x, self.v, self.t = None, 0.0, None
+
+
+class OffsetPredictor:
+    # update is called by vision with each frame's targets, predict by
+    # whatever publishes; a side unseen for timeout seconds is dropped
+    def __init__(self, centerX, distance_between_targets, alpha=0.5, beta=0.1, timeout=0.5):
+        self.centerX = centerX
+        self.distance_between_targets = distance_between_targets
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sides = (AlphaBeta(alpha, beta), AlphaBeta(alpha, beta))
+
+    def update(self, captured, left, right):
+        # captured is the monotonic capture time, left and right may be None
+        with self.lock:
+            for side, target in zip(self.sides, (left, right)):
+                if target is not None:
+                    side.update(target.x, captured)
+
+    def predict(self, now):
+        # the offset at now with a confidence from 0 to 1, or None when a side
+        # is missing or the center is not between the predicted targets
+        with self.lock:
+            confidence = 0
+            xs = []
+            for side in self.sides:
+                if side.x is None:
+                    return None
+                age = now - side.t
+                if age > self.timeout:
+                    side.reset()
+                    return None
+                confidence += (1 - age / self.timeout) / 2
+                xs.append(side.predict(now))
+
+        try:
+            offset = detect.offset_from_center(xs[0], xs[1], self.centerX, self.distance_between_targets)
+        except ValueError:
+            return None
+        return offset, confidence
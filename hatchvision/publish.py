@@ -0,0 +1,58 @@
+# offsets for the roborio
+#
+# next to the plain Offset number every result goes out as one array entry of
+# [offset, capture time, latency, confidence] so the roborio can tell how old
+# the frame was and make up for the slider moving while it was processed;
+# both are flushed right away instead of waiting for the next nt update. the
+# first offset a process publishes also puts how long it took to get there
+# from the process starting under StartupSeconds, so cold starts can be tracked
+
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+OFFSET_DATA = "OffsetData"
+STARTUP_KEY = "StartupSeconds"
+
+# when this module was imported, used when the process start time is unknown
+IMPORTED = time.monotonic()
+
+# seconds from the process starting to its first offset, once there is one
+started = None
+
+
+def process_age():
+    # seconds since the process started, imports and all, from /proc on
+    # linux and since this module was imported elsewhere
+    try:
+        with open("/proc/self/stat") as f:
+            # the start time is the 22nd field, counted after the command name
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - IMPORTED
+
+
+class OffsetPublisher:
+    # flush is NetworkTables.flush, passed in so this needs no networktables;
+    # key is what the plain number goes under and the array under key + Data
+    def __init__(self, table, flush=None, key="Offset"):
+        self.table = table
+        self.flush = flush
+        self.key = key
+        self.data = OFFSET_DATA if key == "Offset" else key + "Data"
+
+    def publish(self, offset, captured, latency, confidence):
+        # captured and latency are in seconds, confidence is from 0 to 1
+        self.table.putNumberArray(self.data, [offset, captured, latency, confidence])
+        self.table.putNumber(self.key, offset)
+        global started
+        if started is None:
+            started = process_age()
+            self.table.putNumber(STARTUP_KEY, started)
+            log.info("first offset published %.2f s after start", started)
+        if self.flush is not None:
+            self.flush()
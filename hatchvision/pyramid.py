@@ -0,0 +1,66 @@
+# coarse to fine detection
+#
+# candidate blobs are found on a downscaled frame, then the nearest left and
+# right ones are refined on small full resolution patches whose moments give
+# sub-pixel centroids, so the offset keeps full resolution accuracy. the
+# threshold, blur and opening are those of a vision chain, the blur and the
+# opening shrink with the frame on the coarse level
+
+import cv2
+
+from hatchvision import detect
+
+
+def refine(frame, chain, bounds, contour, scale):
+    # the target for a coarse contour, centred on the full resolution blob
+    height, width = frame.shape[:2]
+    x, y, w, h = cv2.boundingRect(contour)
+    x0, y0 = max(x * scale - scale, 0), max(y * scale - scale, 0)
+    x1, y1 = min((x + w + 1) * scale, width), min((y + h + 1) * scale, height)
+
+    # a coarse pixel covers scale full pixels, its center is half of that in
+    ((cx, cy), radius) = cv2.minEnclosingCircle(contour)
+    centre = (scale - 1) / 2
+
+    patch = frame[y0:y1, x0:x1]
+    if chain.blur is not None:
+        patch = cv2.GaussianBlur(patch, chain.blur, 0)
+    patch = detect.clean(chain.threshold(patch, bounds), chain.iterations)
+    M = cv2.moments(patch, binaryImage=True)
+    if M["m00"] == 0:
+        return detect.Target(cx * scale + centre, cy * scale + centre, radius * scale)
+
+    return detect.Target(x0 + M["m10"] / M["m00"], y0 + M["m01"] / M["m00"], radius * scale)
+
+
+def find_targets(frame, chain, bounds, scale=2, offset=(0, 0)):
+    # returns the coarse mask along with the same targets as
+    # detect.find_targets, offset is where frame sits when it is a window into
+    # a larger frame
+    height, width = frame.shape[:2]
+    small = cv2.resize(frame, (max(width // scale, 1), max(height // scale, 1)), interpolation=cv2.INTER_AREA)
+
+    # the blur and the erosion on the small frame reach scale times further,
+    # so do less of them; blur kernels stay odd
+    if chain.blur is not None and chain.blur[0] // scale > 1:
+        kernel = chain.blur[0] // scale | 1
+        small = cv2.GaussianBlur(small, (kernel, kernel), 0)
+    mask = detect.clean(chain.threshold(small, bounds), iterations=chain.iterations // scale)
+    cnts = detect.find_contours(mask)
+    candidates, left_contour, right_contour = detect.nearest_contours(
+        cnts, (chain.centerX - offset[0]) / scale, small.shape[1], chain.min_area / scale ** 2)
+
+    ox, oy = offset
+    targets = []
+    for c in candidates:
+        x, y, radius = detect.enclosing(c)
+        targets.append(detect.Target(x * scale + ox, y * scale + oy, radius * scale))
+
+    nearest = []
+    for c in (left_contour, right_contour):
+        if c is not None:
+            x, y, radius = refine(frame, chain, bounds, c, scale)
+            c = detect.Target(x + ox, y + oy, radius)
+        nearest.append(c)
+
+    return mask, targets, nearest[0], nearest[1]
@@ -0,0 +1,154 @@
+# on-robot frame recorder
+#
+# frames go raw into a fixed size ring file that is memory mapped, next to a
+# record of what vision made of each one, so the last few seconds before
+# anything went wrong can be replayed; the copy into the ring happens on a
+# background thread and the kernel writes the pages out in its own time, the
+# file is only flushed when the recorder is closed after the match. raw frames
+# make the file big but let the replay hand out views straight into it
+
+import logging
+
+import time
+
+import cv2
+import numpy as np
+
+from hatchvision.pipeline import LatestQueue, Stage
+
+log = logging.getLogger(__name__)
+
+RING_SUFFIX = ".ring"
+MAGIC = b"HVRING1"
+
+HEADER = np.dtype([("magic", "S8"), ("width", "<u4"), ("height", "<u4"), ("slots", "<u4"), ("count", "<u8")])
+
+# one per slot, seq 0 marks a slot that was never written; offset, lX and rX
+# are nan when they were not found and ms is the vision time of the frame
+RECORD = np.dtype([("seq", "<u8"), ("captured", "<f8"), ("offset", "<f8"), ("confidence", "<f4"),
+                   ("lX", "<f4"), ("rX", "<f4"), ("ms", "<f4")])
+
+# sections start on page boundaries
+PAGE = 4096
+
+
+def layout(width, height, slots):
+    # byte offsets of the records and the frames, and the file size
+    records = PAGE
+    frames = records + -(-RECORD.itemsize * slots // PAGE) * PAGE
+    return records, frames, frames + slots * height * width * 3
+
+
+class RingFile:
+    # the memory maps of a ring file, mode is "r+" to write, "r" to read and
+    # "c" to read into arrays that can be drawn on without touching the file
+    def __init__(self, path, mode="r"):
+        self.header = np.memmap(path, dtype=HEADER, mode=mode, shape=(1,))
+        if self.header["magic"][0] != MAGIC:
+            raise IOError("{} is not a ring file".format(path))
+
+        self.width, self.height, self.slots = (int(self.header[key][0]) for key in ("width", "height", "slots"))
+        records, frames, size = layout(self.width, self.height, self.slots)
+        self.records = np.memmap(path, dtype=RECORD, mode=mode, offset=records, shape=(self.slots,))
+        self.frames = np.memmap(path, dtype=np.uint8, mode=mode, offset=frames,
+                                shape=(self.slots, self.height, self.width, 3))
+
+    @classmethod
+    def create(cls, path, width, height, slots):
+        size = layout(width, height, slots)[2]
+        with open(path, "wb") as f:
+            f.truncate(size)
+            f.write(np.array([(MAGIC, width, height, slots, 0)], dtype=HEADER).tobytes())
+        return cls(path, "r+")
+
+    def order(self):
+        # the written slots, oldest first
+        written = np.flatnonzero(self.records["seq"])
+        return written[np.argsort(self.records["seq"][written])]
+
+    def flush(self):
+        for array in (self.header, self.records, self.frames):
+            array.flush()
+
+
+class RingRecorder:
+    # put hands over a frame with what vision made of it, release is called
+    # with the frame once it has been copied or when it had to be let go;
+    # with wait no frame is let go, to record every frame of a replay
+    def __init__(self, path, width, height, slots=300, wait=False):
+        self.ring = RingFile.create(path, width, height, slots)
+        self.path = path
+        self.count = 0
+        self.queue = LatestQueue(2, on_drop=lambda item: item[2](item[0]), wait=wait)
+        self.stage = Stage("record", self.write, inbox=self.queue)
+        self.stage.start()
+
+    def put(self, image, record, release):
+        # record is a tuple in RECORD order without seq
+        self.queue.put((image, record, release))
+
+    def write(self, item):
+        image, record, release = item
+        slot = self.count % self.ring.slots
+        self.count += 1
+
+        # clear the slot first so a half written one is never replayed
+        try:
+            self.ring.records[slot]["seq"] = 0
+            np.copyto(self.ring.frames[slot], image)
+        finally:
+            release(image)
+        self.ring.records[slot] = (self.count,) + tuple(record)
+        self.ring.header["count"] = self.count
+
+    def close(self):
+        # closing the queue lets the stage write what is queued before it ends
+        self.queue.close()
+        self.stage.join()
+        self.ring.flush()
+        log.info("recorded %d frames, the last %d are in %s", self.count, min(self.count, self.ring.slots), self.path)
+
+
+class RingSource:
+    # replays a ring file through the frame source interface; read without a
+    # buffer hands out a view into the file, so nothing is copied unless the
+    # frames have to be resized to width
+    def __init__(self, path, width=0, height=0):
+        self.ring = RingFile(path, "c")
+        self.width, self.height = self.ring.width, self.ring.height
+        if width > 0:
+            self.width, self.height = width, height if height > 0 else int(self.ring.height * width / float(self.ring.width))
+        self.slots = self.ring.order()
+        self.count = 0
+        self.dropped = 0
+        self.live = False
+        self.finished = False
+        self.record = None
+
+    def start(self):
+        return self
+
+    def first(self, timeout=None):
+        return len(self.slots) > 0
+
+    def read(self, dst=None, timeout=None):
+        # the next frame, (0, None) and finished at the end; the record of
+        # it, with its capture time on the robot and what vision made of it,
+        # is left in self.record
+        if self.count >= len(self.slots):
+            self.finished = True
+            return 0, None
+
+        slot = self.slots[self.count]
+        self.count += 1
+        self.record = self.ring.records[slot]
+        frame = self.ring.frames[slot]
+        if (self.width, self.height) != (self.ring.width, self.ring.height):
+            frame = cv2.resize(frame, (self.width, self.height), dst=dst, interpolation=cv2.INTER_AREA)
+        elif dst is not None:
+            np.copyto(dst, frame)
+            frame = dst
+        return time.monotonic(), frame
+
+    def stop(self):
+        pass
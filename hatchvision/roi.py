@@ -0,0 +1,57 @@
+# region of interest tracking
+#
+# once both targets have been found the next pair is almost always close by,
+# so only a padded window around the last pair is thresholded and searched;
+# contours are found with an offset so they stay in full frame coordinates
+
+
+class RoiTracker:
+    def __init__(self, pad=40, refresh=30):
+        self.pad = pad
+        self.refresh = refresh
+        self.box = None
+        self.area = 0
+        self.frames = 0
+
+    def window(self, frame):
+        # (x, y, w, h) of the part of the frame to search, the whole frame
+        # when there is no pair to follow or it is time for a full search
+        height, width = frame.shape[:2]
+        if self.box is None or self.frames >= self.refresh:
+            return 0, 0, width, height
+
+        x0, y0, x1, y1 = self.box
+        x0, y0 = max(x0 - self.pad, 0), max(y0 - self.pad, 0)
+        x1, y1 = min(x1 + self.pad, width), min(y1 + self.pad, height)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def update(self, window, frame, left, right):
+        # follow the pair of targets found in window, or fall back to a full
+        # search when it was lost or might have been cut off
+        self.box = None
+        self.frames += 1
+        if left is None or right is None:
+            return
+
+        x0 = int(min(left.x - left.radius, right.x - right.radius))
+        y0 = int(min(left.y - left.radius, right.y - right.radius))
+        x1 = int(max(left.x + left.radius, right.x + right.radius)) + 1
+        y1 = int(max(left.y + left.radius, right.y + right.radius)) + 1
+
+        # a pair touching an inner edge of the window may be clipped
+        height, width = frame.shape[:2]
+        wx, wy, ww, wh = window
+        if (wx > 0 and x0 <= wx) or (wy > 0 and y0 <= wy) \
+                or (wx + ww < width and x1 >= wx + ww) or (wy + wh < height and y1 >= wy + wh):
+            return
+
+        # a big change in size means we are probably following something else
+        area = left.radius ** 2 + right.radius ** 2
+        full = window[2] == width and window[3] == height
+        if not full and not self.area / 2 <= area <= self.area * 2:
+            return
+
+        if full:
+            self.frames = 0
+        self.box = (x0, y0, x1, y1)
+        self.area = area
@@ -0,0 +1,236 @@
+# spread the vision chain over several cores
+#
+# whole frames are handed to a pool of worker processes, each worker has a
+# shared-memory slot its frames go into and a pipe of its own, so only the
+# bounds are pickled, and results are put back into capture order before
+# they are used. nothing is shared between the workers, so one that dies
+# cannot leave a lock held that the others wait on; the frame it was on is
+# skipped and another worker takes its place. every worker compiles the
+# vision chain from the same config, frames from several cameras share the
+# pool and each worker keeps a chain per camera so their bounds never make
+# each other's threshold engine rebuild. the workers are
+# started from a fork server rather than forked from the vision process,
+# which by then has capture, networktables and timing threads running and
+# a fork could copy a lock one of them holds
+
+import collections
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+from hatchvision.chain import VisionChain
+
+log = logging.getLogger(__name__)
+
+START_METHOD = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+
+# a vision result, frame and mask are views into the shared slot and are only
+# valid until the next result is taken from the pool
+Result = collections.namedtuple("Result", ["seq", "timestamp", "frame", "mask", "candidates", "left", "right", "camera"])
+
+
+class Slot:
+    # a frame and its mask backed by shared memory
+    def __init__(self, width, height, name=None):
+        size = height * width * 4
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.frame = np.ndarray((height, width, 3), dtype=np.uint8, buffer=self.shm.buf)
+        self.mask = np.ndarray((height, width), dtype=np.uint8, buffer=self.shm.buf, offset=height * width * 3)
+
+    def close(self):
+        # drop the views before closing or the buffer stays exported
+        del self.frame, self.mask
+        self.shm.close()
+
+
+def work(conn, name, width, height, cpu, config):
+    # pin this worker if asked and keep opencv from starting its own threads
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    cv2.setNumThreads(1)
+
+    slot = Slot(width, height, name)
+    chains = collections.defaultdict(lambda: VisionChain(config, (width, height)))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        seq, camera, bounds = task
+        try:
+            mask, candidates, left, right = chains[camera](slot.frame, bounds, mask=slot.mask)
+        except Exception:
+            log.exception("worker failed on frame %d", seq)
+            candidates, left, right = [], None, None
+
+        # always answer so the reorder stage never waits on a lost frame
+        conn.send((seq, candidates, left, right))
+
+    slot.close()
+
+
+class ShardPool:
+    # config is the vision chain config, frames are width by height
+    def __init__(self, workers, config, width, height, cpus=None):
+        self.width = width
+        self.height = height
+        self.config = config
+        self.cpus = cpus
+        self.context = mp.get_context(START_METHOD)
+
+        # a slot per worker, a frame is only dispatched once its worker is free
+        self.slots = [Slot(width, height) for i in range(workers)]
+        self.free = queue.Queue()
+        for index in range(workers):
+            self.free.put(index)
+
+        self.conns = [None] * workers
+        self.workers = [None] * workers
+        for index in range(workers):
+            self.spawn(index)
+
+        # sequence numbers in dispatch order, guarded by the lock
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.timestamps = {}
+        self.stopped = threading.Event()
+        self.dispatcher = None
+
+    def spawn(self, index):
+        # start the worker for a slot with a new pipe to it
+        cpu = self.cpus[index % len(self.cpus)] if self.cpus else None
+        conn, child = self.context.Pipe()
+        process = self.context.Process(target=work, name="vision-{}".format(index), daemon=True,
+                                       args=(child, self.slots[index].shm.name, self.width, self.height, cpu, self.config))
+        process.start()
+        child.close()
+        self.conns[index], self.workers[index] = conn, process
+
+    def start(self, frames, bounds, release=None):
+        # dispatch the newest frame from frames whenever a worker is free,
+        # bounds is called with the camera of every frame for its current
+        # Bounds and release with every frame image once it has been copied
+        # into its slot
+        self.dispatcher = threading.Thread(target=self.dispatch, args=(frames, bounds, release), name="dispatch", daemon=True)
+        self.dispatcher.start()
+        return self
+
+    def dispatch(self, frames, bounds, release):
+        while not self.stopped.is_set():
+            try:
+                index = self.free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # only take a frame once there is a slot for it, so it is the newest
+            item = None
+            while item is None and not self.stopped.is_set():
+                item = frames.get(timeout=0.1)
+                if item is None and frames.closed:
+                    self.stopped.set()
+            if item is None:
+                break
+
+            slot = self.slots[index]
+            if item.image.shape == slot.frame.shape:
+                np.copyto(slot.frame, item.image)
+            else:
+                cv2.resize(item.image, (self.width, self.height), dst=slot.frame)
+            if release is not None:
+                release(item.image)
+
+            # a worker that has just died is found by the reorder stage, which
+            # skips the frame sent to it
+            with self.lock:
+                self.pending.append(item.seq)
+                self.timestamps[item.seq] = (item.timestamp, item.camera, index)
+                try:
+                    self.conns[index].send((item.seq, item.camera, bounds(item.camera)))
+                except OSError:
+                    pass
+
+    def ordered(self):
+        # yield results in capture order, a slot is handed back to the
+        # dispatcher once the consumer asks for the next result; once the
+        # frames run out the results still in flight are waited for
+        done = {}
+        while not self.stopped.is_set() or self.pending:
+            self.revive(done)
+            for conn in wait(list(self.conns), timeout=0.1):
+                try:
+                    seq, candidates, left, right = conn.recv()
+                except (EOFError, OSError):
+                    continue
+                done[seq] = (candidates, left, right)
+
+            while True:
+                with self.lock:
+                    if not self.pending or self.pending[0] not in done:
+                        break
+                    seq = self.pending.popleft()
+                    timestamp, camera, index = self.timestamps.pop(seq)
+
+                candidates, left, right = done.pop(seq)
+                slot = self.slots[index]
+                yield Result(seq, timestamp, slot.frame, slot.mask, candidates, left, right, camera)
+                self.free.put(index)
+
+    def revive(self, done):
+        # skip the frame a dead worker was on, hand its slot back and start
+        # another worker for it unless the pool is stopping
+        for index, process in enumerate(self.workers):
+            if process.is_alive():
+                continue
+
+            with self.lock:
+                lost = [seq for seq, (timestamp, camera, slot) in self.timestamps.items()
+                        if slot == index and seq not in done]
+                for seq in lost:
+                    self.pending.remove(seq)
+                    del self.timestamps[seq]
+                if not self.stopped.is_set():
+                    log.error("worker %s died with exit code %s, starting another", process.name, process.exitcode)
+                    self.conns[index].close()
+                    self.spawn(index)
+
+            for seq in lost:
+                log.warning("frame %d was lost with its worker", seq)
+            if lost:
+                self.free.put(index)
+
+    def close(self):
+        self.stopped.set()
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in self.workers:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+        for conn in self.conns:
+            conn.close()
+        for slot in self.slots:
+            slot.close()
+            slot.shm.unlink()
@@ -0,0 +1,263 @@
+# frame sources
+#
+# one interface over the usb camera, the robot's mjpeg stream, a cscore camera
+# and recorded files: read(dst) fills the caller's buffer and returns it with
+# the monotonic time the frame was grabbed, first() waits for the first frame
+# instead of sleeping a fixed time, and dropped counts the frames that were
+# overwritten before anyone read them. live sources always hand out the
+# newest frame, files hand out every frame in order and set finished once
+# there are no more; live tells the two apart, so whoever reads a file can
+# wait for it instead of skipping frames. the frame size is asked of the
+# camera itself and frames are only resized here when it will not give that
+# size or cannot be asked at all, like a stream or a file
+
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from hatchvision.recorder import RING_SUFFIX, RingSource
+
+log = logging.getLogger(__name__)
+
+
+def target_size(native, width, height):
+    # the size to deliver, a missing height keeps the aspect ratio the same
+    # way imutils.resize does
+    if width <= 0:
+        return native
+    if height <= 0:
+        height = int(native[1] * width / float(native[0]))
+    return (width, height)
+
+
+class Resizer:
+    # shrinks frames that come in at the wrong size, reading them into a
+    # buffer of their own first
+    def __init__(self, size):
+        self.size = size
+        self.raw = None
+
+    def read(self, read, dst):
+        grabbed, self.raw = read(self.raw)
+        if not grabbed:
+            return False, dst
+        return True, cv2.resize(self.raw, self.size, dst=dst, interpolation=cv2.INTER_AREA)
+
+
+class CaptureSource:
+    # a usb camera index or an mjpeg url read on a thread of its own, only the
+    # newest frame is kept; width and height are asked of a camera but an
+    # mjpeg stream can only be resized
+    def __init__(self, src, width=0, height=0, fps=0):
+        self.src = src
+        self.capture = cv2.VideoCapture(src)
+        if not self.capture.isOpened():
+            raise IOError("Cannot open {}".format(src))
+
+        native = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.width, self.height = target_size(native, width, height)
+        if isinstance(src, int):
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            if fps > 0:
+                self.capture.set(cv2.CAP_PROP_FPS, fps)
+            native = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+        self.resizer = None
+        if native != (self.width, self.height):
+            log.warning("%s gives %dx%d frames, resizing them to %dx%d", src, native[0], native[1], self.width, self.height)
+            self.resizer = Resizer((self.width, self.height))
+
+        self.ready = threading.Condition()
+        self.newest = None
+        self.spare = None
+        self.taken = 0
+        self.count = 0
+        self.dropped = 0
+        self.live = True
+        self.finished = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="source", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def grab(self, image):
+        if self.resizer is not None:
+            return self.resizer.read(self.capture.read, image)
+        return self.capture.read(image)
+
+    def run(self):
+        while not self.stopped:
+            grabbed, image = self.grab(self.spare)
+            if not grabbed:
+                # a camera hiccup or a stream reconnecting, try again shortly
+                time.sleep(0.01)
+                continue
+            timestamp = time.monotonic()
+
+            with self.ready:
+                # the frame being replaced becomes the buffer for the next one
+                if self.newest is not None:
+                    if self.newest[0] > self.taken:
+                        self.dropped += 1
+                    self.spare = self.newest[2]
+                else:
+                    self.spare = None
+
+                self.count += 1
+                self.newest = (self.count, timestamp, image)
+                self.ready.notify_all()
+
+    def first(self, timeout=None):
+        # wait for the first frame, False if none came in time
+        with self.ready:
+            return self.ready.wait_for(lambda: self.newest is not None, timeout)
+
+    def read(self, dst=None, timeout=None):
+        # a frame newer than the last one read, copied into dst, with its
+        # timestamp; (0, None) on timeout or once stopped
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.stopped or (self.newest is not None and self.newest[0] > self.taken),
+                                       timeout) or self.stopped:
+                return 0, None
+
+            seq, timestamp, image = self.newest
+            self.taken = seq
+
+            # copy while holding the lock so the reader cannot reuse the buffer
+            if dst is None or dst.shape != image.shape:
+                dst = image.copy()
+            else:
+                np.copyto(dst, image)
+        return timestamp, dst
+
+    def stop(self):
+        with self.ready:
+            self.stopped = True
+            self.ready.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.capture.release()
+
+
+class FileSource:
+    # a recorded file, read as it is asked for so no frame is skipped
+    def __init__(self, path, width=0, height=0):
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError("Cannot open {}".format(path))
+
+        native = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.width, self.height = target_size(native, width, height)
+        self.resizer = Resizer((self.width, self.height)) if native != (self.width, self.height) else None
+        self.count = 0
+        self.dropped = 0
+        self.live = False
+        self.finished = False
+
+    def start(self):
+        return self
+
+    def first(self, timeout=None):
+        return True
+
+    def read(self, dst=None, timeout=None):
+        # the next frame, (0, None) and finished at the end of the file
+        if self.resizer is not None:
+            grabbed, frame = self.resizer.read(self.capture.read, dst)
+        else:
+            grabbed, frame = self.capture.read(dst)
+        if not grabbed:
+            self.finished = True
+            return 0, None
+
+        self.count += 1
+        return time.monotonic(), frame
+
+    def stop(self):
+        self.capture.release()
+
+
+class CscoreSource:
+    # a usb camera through cscore, which keeps only the newest frame itself;
+    # the video mode is set on the camera and frames missed between two reads
+    # are counted from the gaps between their capture times. frames carry the
+    # time cscore captured them, moved onto the monotonic clock by the offset
+    # between the two measured once here
+    def __init__(self, device=0, width=640, height=480, fps=30):
+        import cscore as cs
+
+        self.skew = time.monotonic() - cs.getTime() / 1e6
+        self.camera = cs.UsbCamera("rPi Camera {}".format(device), device)
+        self.camera.setVideoMode(cs.VideoMode.PixelFormat.kMJPEG, width, height, fps)
+        self.sink = cs.CvSink("cvsink")
+        self.sink.setSource(self.camera)
+
+        mode = self.camera.getVideoMode()
+        self.native = (mode.width, mode.height)
+        self.period = 1e6 / (mode.fps or fps)
+        self.width, self.height = width, height
+        self.resizer = None
+        if self.native != (width, height):
+            log.warning("camera gives %dx%d frames, resizing them to %dx%d", mode.width, mode.height, width, height)
+            self.resizer = Resizer((width, height))
+
+        self.last = 0
+        self.count = 0
+        self.dropped = 0
+        self.live = True
+        self.finished = False
+
+    def start(self):
+        return self
+
+    def first(self, timeout=None):
+        deadline = time.monotonic() + (timeout if timeout is not None else float("inf"))
+        while time.monotonic() < deadline:
+            if self.read(timeout=min(1.0, max(deadline - time.monotonic(), 0.01)))[1] is not None:
+                return True
+        return False
+
+    def read(self, dst=None, timeout=None):
+        captured = 0
+
+        def grab(image):
+            # grabFrame gives the capture time in microseconds, zero on error
+            nonlocal captured
+            if image is None:
+                image = np.empty((self.native[1], self.native[0], 3), dtype=np.uint8)
+            captured, image = self.sink.grabFrame(image, timeout if timeout is not None else 0.225)
+            return captured != 0, image
+
+        grabbed, frame = self.resizer.read(grab, dst) if self.resizer is not None else grab(dst)
+        if not grabbed:
+            return 0, None
+
+        if self.last:
+            self.dropped += max(int(round((captured - self.last) / self.period)) - 1, 0)
+        self.last = captured
+        self.count += 1
+        return captured / 1e6 + self.skew, frame
+
+    def stop(self):
+        self.sink.setEnabled(False)
+
+
+def open_source(spec, width=0, height=0, fps=0):
+    # a camera index, an http(s) mjpeg url, cscore:<device>, a ring file
+    # from the recorder or a video file, started; width and height of 0 keep
+    # what the source gives
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CaptureSource(int(spec), width, height, fps).start()
+    if str(spec).startswith(("http://", "https://")):
+        return CaptureSource(spec, width, height).start()
+    if str(spec).startswith("cscore:"):
+        return CscoreSource(int(spec.split(":", 1)[1] or 0), width or 640, height or 480, fps or 30).start()
+    if str(spec).endswith(RING_SUFFIX):
+        return RingSource(spec, width, height).start()
+    return FileSource(spec, width, height).start()
@@ -0,0 +1,77 @@
+# dashboard streams
+#
+# each stream sends a reduced size copy at a capped rate and skips the frame
+# altogether while no client is watching, so mjpeg encoding only costs what
+# the dashboard is actually shown; the caps live on the dashboard under
+# Stream/<name> as FPS and Kbps and are picked up by an entry listener, so
+# asking whether a frame is wanted costs no networktables call
+
+import threading
+import time
+
+import cv2
+
+# jpeg quality used to estimate the size of an encoded frame
+QUALITY = 80
+
+# how often the encoded size is measured again, in seconds
+ESTIMATE_EVERY = 2.0
+
+
+class DashboardStream:
+    # source is the cscore CvSource for the stream, scale divides the frame
+    # size and interpolation is how the frame is shrunk to it
+    def __init__(self, source, table, scale=2, fps=10, kbps=0, interpolation=cv2.INTER_AREA):
+        self.source = source
+        self.scale = scale
+        self.interpolation = interpolation
+        self.lock = threading.Lock()
+        self.caps = {"FPS": fps, "Kbps": kbps}
+        self.last = 0
+        self.bits = 0
+        self.estimated = 0
+        self.small = None
+
+        for key, value in self.caps.items():
+            table.setDefaultNumber(key, value)
+        table.addEntryListener(self.changed, immediateNotify=True)
+
+    def changed(self, table, key, value, isNew):
+        # called on the networktables thread
+        if key in self.caps:
+            with self.lock:
+                self.caps[key] = value
+
+    def interval(self):
+        # seconds between frames for whichever cap is tighter, a cap of 0 is off
+        with self.lock:
+            fps, kbps = self.caps["FPS"], self.caps["Kbps"]
+
+        interval = 1 / fps if fps > 0 else 0
+        if kbps > 0 and self.bits > 0:
+            interval = max(interval, self.bits / (kbps * 1000))
+        return interval
+
+    def wanted(self, now=None):
+        # whether the next frame should be sent, cheap enough to ask per frame
+        if now is None:
+            now = time.monotonic()
+        return self.source.isEnabled() and now - self.last >= self.interval()
+
+    def put(self, image):
+        # shrink the image and send it, every so often also measure how big
+        # it is encoded so the bitrate cap knows what a frame costs
+        now = time.monotonic()
+        self.last = now
+
+        if self.scale > 1:
+            size = (image.shape[1] // self.scale, image.shape[0] // self.scale)
+            self.small = cv2.resize(image, size, dst=self.small, interpolation=self.interpolation)
+            image = self.small
+
+        if now - self.estimated >= ESTIMATE_EVERY:
+            self.estimated = now
+            encoded = cv2.imencode(".jpg", image, (cv2.IMWRITE_JPEG_QUALITY, QUALITY))[1]
+            self.bits = len(encoded) * 8
+
+        self.source.putFrame(image)
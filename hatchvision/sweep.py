@@ -0,0 +1,144 @@
+# accuracy against speed for the detection settings
+#
+# runs every combination of resolution, threshold engine, detector, pyramid
+# scale, blur and morphology over a grid of synthetic scenes and prints how
+# fast each was and how many inches it was off; the settings no other
+# setting beats on fps, detection rate and p95 error together are marked as
+# the pareto front. every backend should report the same offset as the
+# contour path on the same frame, the vs contours column is how far apart
+# they were on average:
+#
+#   python -m hatchvision.sweep -r 640x480,320x240 -b 0,5 -m 0,2 -o=-3,0,3
+#
+# lists that start with a negative number need the = form
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from hatchvision import chain, synthetic
+from hatchvision.bench import FrameDetector
+from hatchvision.bounds import Bounds
+
+
+def numbers(text, kind=float):
+    return [kind(value) for value in text.split(",")]
+
+
+def settings(args):
+    # the pyramid has its own detector, so only vary that when it is off;
+    # it scales the blur and morphology of the chain down with the frame
+    seen = set()
+    for size, threshold, detector, scale, blur, iterations in itertools.product(
+            [tuple(int(v) for v in r.split("x")) for r in args["resolutions"].split(",")],
+            args["thresholds"].split(","), args["detectors"].split(","),
+            numbers(args["pyramid"], int), numbers(args["blur"], int), numbers(args["morphology"], int)):
+        if scale > 1:
+            detector = "-"
+        key = (size, threshold, detector, scale, blur, iterations)
+        if key not in seen:
+            seen.add(key)
+            yield key
+
+
+def score(scenes, bounds, size, threshold, detector, scale, blur, iterations, hfov):
+    find = FrameDetector(chain.declare(threshold, "contours" if detector == "-" else detector, blur, iterations), scale)
+    find.chain(size[0], size[1], bounds)
+
+    seconds, errors, offsets = 0, [], []
+    for scene in scenes:
+        frame = synthetic.render(scene, size[0], size[1], hfov)
+        start = time.perf_counter()
+        offset = find(frame, bounds)[3]
+        seconds += time.perf_counter() - start
+        offsets.append(np.nan if offset is None else offset)
+        if offset is not None:
+            errors.append(abs(offset - scene.offset))
+
+    errors = np.array(errors)
+    return {
+        "resolution": "{}x{}".format(*size),
+        "threshold": threshold,
+        "detector": detector,
+        "pyramid": scale,
+        "blur": blur,
+        "morphology": iterations,
+        "fps": len(scenes) / seconds,
+        "found": len(errors) / len(scenes),
+        "mean": errors.mean() if len(errors) else np.inf,
+        "p95": np.percentile(errors, 95) if len(errors) else np.inf,
+        "offsets": np.array(offsets),
+    }
+
+
+def agreement(result, results):
+    # mean inches between the offsets of result and of the contour path with
+    # the same other settings, over the scenes both found; nan without one
+    for other in results:
+        if other["detector"] == "contours" and all(other[key] == result[key] for key in
+                                                   ("resolution", "threshold", "pyramid", "blur", "morphology")):
+            both = ~np.isnan(result["offsets"]) & ~np.isnan(other["offsets"])
+            if both.any():
+                return np.abs(result["offsets"][both] - other["offsets"][both]).mean()
+    return np.nan
+
+
+def dominates(a, b):
+    # a is at least as good as b everywhere and better somewhere
+    at_least = a["fps"] >= b["fps"] and a["found"] >= b["found"] and a["p95"] <= b["p95"]
+    better = a["fps"] > b["fps"] or a["found"] > b["found"] or a["p95"] < b["p95"]
+    return at_least and better
+
+
+def main():
+    # parse arguments
+    ap = argparse.ArgumentParser(description="sweep detection settings over synthetic scenes")
+    ap.add_argument("-r", "--resolutions", default="640x480,320x240,160x120", help="comma separated WxH to render at")
+    ap.add_argument("-t", "--thresholds", default="hsv", help="comma separated threshold engines")
+    ap.add_argument("-d", "--detectors", default="contours,components,pairs,projections", help="comma separated detection backends")
+    ap.add_argument("-y", "--pyramid", default="0,2", help="comma separated pyramid scales, 0 is off")
+    ap.add_argument("-b", "--blur", default="0,5", help="comma separated gaussian kernel sizes, 0 is off")
+    ap.add_argument("-m", "--morphology", default="0,1,2", help="comma separated erode and dilate iterations")
+    ap.add_argument("-o", "--offsets", default="-5,-2.5,-0.7,0,1.3,4", help="comma separated true offsets in inches")
+    ap.add_argument("-s", "--distances", default="24,48,96", help="comma separated camera distances in inches")
+    ap.add_argument("-w", "--yaws", default="0,10", help="comma separated camera yaws in degrees")
+    ap.add_argument("-n", "--noise", default="0,6", help="comma separated noise sigmas in grey levels")
+    ap.add_argument("-f", "--defocus", default="0,1.5", help="comma separated defocus sigmas in pixels")
+    ap.add_argument("-x", "--distractors", default="0,3", help="comma separated distractor counts")
+    ap.add_argument("-v", "--hfov", type=float, default=60, help="camera horizontal field of view in degrees")
+    ap.add_argument("-a", "--all", action="store_true", help="show settings off the pareto front too")
+    args = vars(ap.parse_args())
+
+    # check every chain up front rather than fail halfway through the sweep
+    combinations = list(settings(args))
+    for size, threshold, detector, scale, blur, iterations in combinations:
+        try:
+            chain.stages(chain.declare(threshold, "contours" if detector == "-" else detector, blur, iterations))
+        except ValueError as e:
+            ap.error(e)
+
+    scenes = synthetic.grid(numbers(args["offsets"]), numbers(args["distances"]), numbers(args["yaws"]),
+                            numbers(args["noise"]), numbers(args["defocus"]), numbers(args["distractors"], int))
+    bounds = Bounds(0, synthetic.LOWER, synthetic.UPPER)
+
+    results = []
+    for setting in combinations:
+        results.append(score(scenes, bounds, *setting, args["hfov"]))
+
+    for result in results:
+        result["pareto"] = not any(dominates(other, result) for other in results)
+        result["contours"] = agreement(result, results)
+
+    print("{} scenes".format(len(scenes)))
+    print("{:>9} {:>9} {:>10} {:>7} {:>4} {:>5} {:>8} {:>6} {:>7} {:>7} {:>11}".format(
+        "", "threshold", "detector", "pyramid", "blur", "morph", "fps", "found", "mean in", "p95 in", "vs contours"))
+    for result in sorted(results, key=lambda r: -r["fps"]):
+        if result["pareto"] or args["all"]:
+            print("{resolution:>9} {threshold:>9} {detector:>10} {pyramid:>7} {blur:>4} {morphology:>5} "
+                  "{fps:8.1f} {found:6.1%} {mean:7.3f} {p95:7.3f} {contours:11.4f}{0}".format(" *" if result["pareto"] else "", **result))
+
+
+if __name__ == "__main__":
+    main()
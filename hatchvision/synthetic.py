@@ -0,0 +1,103 @@
+# synthetic target scenes with a known offset
+#
+# renders the pair of 2 x 5.5 inch tape strips, tilted towards each other and
+# 11.5 inches apart, through a pinhole camera at a given pose, with optional
+# blur, noise and distractor blobs; every scene carries the offset
+# offset_from_center should report for it, so settings can be scored in inches
+
+import collections
+import itertools
+import math
+
+import cv2
+import numpy as np
+
+DISTANCE_BETWEEN_TARGETS = 11.5
+TAPE_WIDTH = 2.0
+TAPE_LENGTH = 5.5
+TAPE_ANGLE = 14.5
+
+# tape lit by a green led ring, hsv (60, 155, 255); LOWER and UPPER take it
+# in with room for noise
+TARGET_COLOUR = (100, 255, 100)
+LOWER = (45, 80, 120)
+UPPER = (75, 255, 255)
+
+# offset is the true offset in inches, distance the camera to wall distance in
+# inches, yaw the camera rotation in degrees, noise the gaussian noise sigma in
+# grey levels, blur the defocus sigma in pixels and distractors the number of
+# extra target coloured blobs; seed fixes the background and noise
+Scene = collections.namedtuple("Scene", ["offset", "distance", "yaw", "noise", "blur", "distractors", "seed"])
+
+
+def tape_corners(centre, angle):
+    # the four corners of one strip on the wall, y is down
+    theta = math.radians(angle)
+    cos, sin = math.cos(theta), math.sin(theta)
+    corners = []
+    for x, y in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+        x, y = x * TAPE_WIDTH / 2, y * TAPE_LENGTH / 2
+        corners.append((centre + x * cos - y * sin, x * sin + y * cos))
+    return corners
+
+
+def project(points, scene, width, height, hfov):
+    # wall points (x, y) in inches to pixels, the wall is z = 0 and the camera
+    # is placed so the ray through the center column hits the wall at -offset,
+    # which is where offset_from_center puts a positive offset
+    yaw = math.radians(scene.yaw)
+    focal = width / (2 * math.tan(math.radians(hfov) / 2))
+    camera = -scene.offset - scene.distance * math.tan(yaw)
+
+    pixels = []
+    for x, y in points:
+        dx, dz = x - camera, scene.distance
+        cx = dx * math.cos(yaw) - dz * math.sin(yaw)
+        cz = dx * math.sin(yaw) + dz * math.cos(yaw)
+        pixels.append((focal * cx / cz + width / 2, focal * y / cz + height / 2))
+    return pixels
+
+
+def render(scene, width=640, height=480, hfov=60, colour=TARGET_COLOUR):
+    # a bgr frame of the scene, the true offset is scene.offset
+    rng = np.random.default_rng(scene.seed)
+
+    # a dim wall lit unevenly from one side
+    ramp = np.linspace(rng.uniform(10, 40), rng.uniform(40, 80), width, dtype=np.float32)
+    frame = np.repeat(ramp[np.newaxis, :, np.newaxis], height, axis=0).repeat(3, axis=2)
+
+    # tape coverage, antialiased with 4 fractional bits so edges land sub-pixel
+    coverage = np.zeros((height, width), dtype=np.uint8)
+    half = DISTANCE_BETWEEN_TARGETS / 2
+    for centre, angle in ((-half, TAPE_ANGLE), (half, -TAPE_ANGLE)):
+        corners = project(tape_corners(centre, angle), scene, width, height, hfov)
+        cv2.fillConvexPoly(coverage, np.round(np.array(corners) * 16).astype(np.int32), 255, cv2.LINE_AA, shift=4)
+
+    # distractors anywhere that is clear of the tape
+    box = cv2.boundingRect(cv2.findNonZero(coverage)) if coverage.any() else (0, 0, 0, 0)
+    for _ in range(scene.distractors):
+        for _ in range(20):
+            x, y = rng.uniform(0, width), rng.uniform(0, height)
+            axes = rng.uniform(3, 25), rng.uniform(3, 25)
+            if not (box[0] - axes[0] - 4 < x < box[0] + box[2] + axes[0] + 4
+                    and box[1] - axes[1] - 4 < y < box[1] + box[3] + axes[1] + 4):
+                break
+        else:
+            continue
+        cv2.ellipse(coverage, ((x, y), (axes[0] * 2, axes[1] * 2), rng.uniform(0, 180)), 255, -1, cv2.LINE_AA)
+
+    alpha = coverage[..., np.newaxis].astype(np.float32) / 255
+    frame = frame * (1 - alpha) + np.array(colour, dtype=np.float32) * alpha
+
+    if scene.blur > 0:
+        frame = cv2.GaussianBlur(frame, (0, 0), scene.blur)
+    if scene.noise > 0:
+        frame += rng.normal(0, scene.noise, frame.shape).astype(np.float32)
+
+    return np.clip(frame, 0, 255).round().astype(np.uint8)
+
+
+def grid(offsets, distances, yaws=(0,), noises=(0,), blurs=(0,), distractors=(0,), seed=0):
+    # every combination of the settings, each with its own seed
+    return [Scene(*values, seed=seed + i)
+            for i, values in enumerate(itertools.product(offsets, distances, yaws, noises, blurs, distractors))]
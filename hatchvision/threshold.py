@@ -0,0 +1,117 @@
+# threshold engines, each turns a bgr frame and the current bounds into a mask
+#
+# hsv is the cvtColor plus inRange path the scripts have always used, lut
+# answers every bgr colour from a table built from the bounds so there is no
+# full frame hsv image at all; both write into dst when it is given
+
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from hatchvision.bounds import PerVersion
+from hatchvision.buffers import Scratch
+from hatchvision.timing import NO_TIMINGS
+
+log = logging.getLogger(__name__)
+
+
+class HsvThreshold:
+    def __init__(self, timings=NO_TIMINGS):
+        self.limits = PerVersion(lambda bounds: (np.array(bounds.lower, dtype=np.float64), np.array(bounds.upper, dtype=np.float64)))
+        self.hsv = Scratch(3)
+        self.timings = timings
+
+    def __call__(self, frame, bounds, dst=None):
+        tick = self.timings.start()
+        lower, upper = self.limits.get(bounds)
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=self.hsv.get(*frame.shape[:2]))
+        tick = self.timings.lap("convert", tick)
+
+        mask = cv2.inRange(hsv, lower, upper, dst=dst)
+        self.timings.lap("threshold", tick)
+        return mask
+
+
+def build_table(bounds):
+    # answer inRange for all 2^24 bgr colours, one blue level at a time so the
+    # hsv scratch image stays small; the table is indexed by b | g << 8 | r << 16
+    g, r = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing="ij")
+    colours = np.empty((256, 256, 3), dtype=np.uint8)
+    colours[..., 1] = g
+    colours[..., 2] = r
+
+    table = np.empty(1 << 24, dtype=np.uint8)
+    for b in range(256):
+        colours[..., 0] = b
+        hsv = cv2.cvtColor(colours, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, bounds.lower, bounds.upper)
+        table[b::256] = mask.T.reshape(-1)
+
+    return table
+
+
+class LutThreshold:
+    # the table takes a while to build on the pi, so it is built on a
+    # background thread and the hsv path is used until it is ready
+    def __init__(self, timings=NO_TIMINGS):
+        self.fallback = HsvThreshold(timings)
+        self.timings = timings
+        self.lock = threading.Lock()
+        self.table = None
+        self.version = None
+        self.building = None
+        self.checked = None
+
+        # scratch buffers for the packed colour index, np.take wants intp
+        # indices and would make a converted copy of any other type
+        self.bgra = Scratch(4)
+        self.index = Scratch(1, np.intp)
+
+    def build(self, bounds):
+        table = build_table(bounds)
+        with self.lock:
+            self.table, self.version = table, bounds.version
+            if self.building == bounds.version:
+                self.building = None
+
+    def __call__(self, frame, bounds, dst=None):
+        with self.lock:
+            table, version = self.table, self.version
+            if version != bounds.version and self.building != bounds.version:
+                self.building = bounds.version
+                threading.Thread(target=self.build, args=(bounds,), name="lut", daemon=True).start()
+
+        if version != bounds.version:
+            return self.fallback(frame, bounds, dst)
+
+        mask = self.lookup(frame, table, dst)
+
+        # check every new table against inRange once
+        if self.checked != version:
+            self.checked = version
+            agreement = np.count_nonzero(mask == self.fallback(frame, bounds)) / mask.size
+            (log.info if agreement == 1 else log.warning)("lut agreement with inRange {:.4%}".format(agreement))
+
+        return mask
+
+    def lookup(self, frame, table, dst=None):
+        height, width = frame.shape[:2]
+        bgra = self.bgra.get(height, width)
+        index = self.index.get(height, width)
+        if dst is None:
+            dst = np.empty((height, width), dtype=np.uint8)
+
+        # pack each pixel into one little endian word and drop the alpha byte
+        tick = self.timings.start()
+        cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=bgra)
+        np.bitwise_and(bgra.view(np.uint32)[..., 0], 0xFFFFFF, out=index)
+        tick = self.timings.lap("convert", tick)
+
+        mask = np.take(table, index, out=dst, mode="clip")
+        self.timings.lap("threshold", tick)
+        return mask
+
+
+THRESHOLDS = {"hsv": HsvThreshold, "lut": LutThreshold}
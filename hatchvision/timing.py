@@ -0,0 +1,100 @@
+# per stage latency
+#
+# every stage laps a monotonic clock when it finishes, the last few hundred
+# laps of each stage are kept and their p50/p95/p99 are published to a
+# diagnostics table and optionally appended to a csv file once a second;
+# NO_TIMINGS does nothing, so the calls can stay in the loop when it is off
+
+import csv
+import logging
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    # a ring of the latest lap times in milliseconds
+    def __init__(self, size):
+        self.samples = np.zeros(size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples[self.count % len(self.samples)] = seconds * 1000
+        self.count += 1
+
+    def percentiles(self):
+        return np.percentile(self.samples[:min(self.count, len(self.samples))], PERCENTILES)
+
+
+class Timings:
+    def __init__(self, table=None, path=None, size=300, every=1.0):
+        self.table = table
+        self.size = size
+        self.every = every
+        self.stages = {}
+
+        self.file = open(path, "a", newline="") if path else None
+        self.writer = csv.writer(self.file) if self.file else None
+        if self.file and self.file.tell() == 0:
+            self.writer.writerow(["time", "stage", "count"] + ["p{}".format(p) for p in PERCENTILES])
+
+        self.stopped = threading.Event()
+        self.reporter = threading.Thread(target=self.report, name="timings", daemon=True)
+        self.reporter.start()
+
+    def start(self):
+        return time.perf_counter()
+
+    def lap(self, name, since):
+        # record the time since since against name and return the new start
+        now = time.perf_counter()
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages.setdefault(name, StageTimer(self.size))
+        stage.add(now - since)
+        return now
+
+    def report(self):
+        while not self.stopped.wait(self.every):
+            self.publish()
+
+    def publish(self):
+        now = time.time()
+        for name, stage in list(self.stages.items()):
+            if stage.count == 0:
+                continue
+
+            values = list(stage.percentiles())
+            if self.table is not None:
+                self.table.putNumberArray(name, values)
+            if self.writer is not None:
+                self.writer.writerow([round(now, 3), name, stage.count] + [round(v, 3) for v in values])
+
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.reporter.join()
+        self.publish()
+        if self.file is not None:
+            self.file.close()
+
+
+class NoTimings:
+    def start(self):
+        return 0
+
+    def lap(self, name, since):
+        return 0
+
+    def close(self):
+        pass
+
+
+NO_TIMINGS = NoTimings()
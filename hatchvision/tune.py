@@ -0,0 +1,234 @@
+# hsv bounds from labelled sample frames
+#
+# every sample is an image with a mask next to it, name.png and
+# name.mask.png, white where the tape is. each sample is converted to hsv
+# once, in a pool of worker processes, and only its colour histograms for tape
+# and for everything else are kept. summed-area tables of those histograms
+# give the tape and background pixel counts inside any bounds with eight
+# lookups, so coordinate descent can score every lower and upper pair of a
+# channel at once. the bounds with the best overlap from the different
+# starting points are then ranked by how well detection does with them,
+# running the robot's vision chain on the samples, how often it finds the
+# offset first and how far off it is second, and the winner is put on the
+# dashboard:
+#
+#   python -m hatchvision.tune samples/ -r 10.24.25.2
+
+import argparse
+import glob
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from hatchvision import chain, detect
+from hatchvision.bench import ROBOT_CONFIG, FrameDetector
+from hatchvision.bounds import Bounds, LOWER_KEYS, UPPER_KEYS
+
+# histogram bins in (h, s, v) order, hue only goes to 179
+STEPS = np.array([2, 4, 4])
+BINS = (90, 64, 64)
+MASK_SUFFIX = ".mask.png"
+
+
+def find_samples(paths):
+    # pairs of image and mask files, images without a mask are skipped
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            images.extend(glob.glob(path))
+
+    samples = []
+    for image in sorted(set(images)):
+        if image.endswith(MASK_SUFFIX) or not image.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")):
+            continue
+        mask = os.path.splitext(image)[0] + MASK_SUFFIX
+        if os.path.exists(mask):
+            samples.append((image, mask))
+        else:
+            print("[WARN] no mask for", image)
+    return samples
+
+
+def histograms(sample):
+    # tape and background colour counts of one sample, in a worker process
+    image, mask = cv2.imread(sample[0]), cv2.imread(sample[1], cv2.IMREAD_GRAYSCALE) > 127
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    index = np.ravel_multi_index(tuple((hsv // STEPS).reshape(-1, 3).T), BINS)
+    tape = np.bincount(index[mask.reshape(-1)], minlength=np.prod(BINS))
+    total = np.bincount(index, minlength=np.prod(BINS))
+    return tape, total - tape
+
+
+def summed(counts):
+    # summed-area table with a row of zeros in front of every axis
+    table = np.zeros(tuple(n + 1 for n in BINS), dtype=np.int64)
+    table[1:, 1:, 1:] = counts.reshape(BINS).cumsum(0).cumsum(1).cumsum(2)
+    return table
+
+
+def box(table, lo, hi):
+    # pixels inside bins lo to hi inclusive, both (k, 3) arrays of bin indices
+    hi = hi + 1
+    total = 0
+    for corner in range(8):
+        pick = [(hi, lo)[(corner >> axis) & 1][:, axis] for axis in range(3)]
+        sign = -1 if bin(corner).count("1") % 2 else 1
+        total = total + sign * table[pick[0], pick[1], pick[2]]
+    return total
+
+
+def scores(tape, background, lo, hi):
+    # intersection over union of the bounds with the labelled tape
+    inside = box(tape, lo, hi)
+    return inside / (tape[-1, -1, -1] + box(background, lo, hi))
+
+
+def descend(job):
+    # coordinate descent from one starting point, in a worker process;
+    # returns the best score with its bounds as bin indices
+    tape, background, lo, hi = job
+    lo, hi = np.array(lo), np.array(hi)
+    best = scores(tape, background, lo[np.newaxis], hi[np.newaxis])[0]
+
+    improved = True
+    while improved:
+        improved = False
+        for channel in range(3):
+            # every lower and upper pair of this channel with the others fixed
+            a, b = np.triu_indices(BINS[channel])
+            los, his = np.repeat(lo[np.newaxis], len(a), 0), np.repeat(hi[np.newaxis], len(a), 0)
+            los[:, channel], his[:, channel] = a, b
+
+            candidates = scores(tape, background, los, his)
+            pick = np.argmax(candidates)
+            if candidates[pick] > best:
+                best, lo, hi = candidates[pick], los[pick], his[pick]
+                improved = True
+
+    return best, tuple(lo), tuple(hi)
+
+
+def to_bounds(lo, hi):
+    # bin indices to inclusive inRange bounds
+    lower = tuple(int(v) for v in np.array(lo) * STEPS)
+    upper = tuple(int(v) for v in (np.array(hi) + 1) * STEPS - 1)
+    return Bounds(0, lower, upper)
+
+
+def from_bounds(lower, upper):
+    return tuple(np.array(lower) // STEPS), tuple(np.minimum(np.array(upper) // STEPS, np.array(BINS) - 1))
+
+
+def check(job):
+    # whether detection with the bounds finds the same targets as the label
+    sample, bounds, config = job
+    image, mask = cv2.imread(sample[0]), cv2.imread(sample[1], cv2.IMREAD_GRAYSCALE)
+    height, width = mask.shape
+    find = FrameDetector(config)
+    offset = find(image, bounds)[3]
+
+    labelled = None
+    vision = find.chain(width, height)
+    candidates, left, right = detect.find_targets(mask, vision.centerX, width, vision.min_area)
+    if left is not None and right is not None:
+        try:
+            labelled = vision.offset_from_center(left.x, right.x)
+        except ValueError:
+            pass
+
+    return offset, labelled
+
+
+def quality(results):
+    # the share of labelled frames detection found the offset in and its
+    # mean error in inches
+    errors = [abs(offset - labelled) for offset, labelled in results if offset is not None and labelled is not None]
+    labelled = sum(1 for offset, labelled in results if labelled is not None)
+    return len(errors) / labelled if labelled else 0, np.mean(errors) if errors else float("inf")
+
+
+def main():
+    # parse arguments
+    ap = argparse.ArgumentParser(description="find the hsv bounds that best match labelled sample frames")
+    ap.add_argument("samples", nargs="+", help="images, folders or globs, each image with a name.mask.png next to it")
+    ap.add_argument("-p", "--processes", type=int, default=os.cpu_count(), help="number of worker processes")
+    ap.add_argument("-s", "--starts", type=int, default=8, help="number of random starting points besides the defaults")
+    ap.add_argument("-k", "--keep", type=int, default=5, help="number of the best overlapping bounds to rank by detection")
+    ap.add_argument("-j", "--config", default=ROBOT_CONFIG, help="vision chain config to detect with, the robot's by default")
+    ap.add_argument("-l", "--lower", nargs="+", type=int, default=[113, 0, 197], help="HSV lower bounds to start from")
+    ap.add_argument("-u", "--upper", nargs="+", type=int, default=[157, 10, 255], help="HSV upper bounds to start from")
+    ap.add_argument("-r", "--roborio", help="put the bounds on the dashboard of the networktables server at this address")
+    ap.add_argument("-c", "--connect", type=float, default=5, help="seconds to wait for the networktables server")
+    args = vars(ap.parse_args())
+
+    try:
+        config = chain.load(args["config"])
+        chain.stages(config)
+    except (IOError, KeyError, ValueError) as e:
+        ap.error("{}: {}".format(args["config"], e))
+
+    samples = find_samples(args["samples"])
+    if not samples:
+        sys.exit("No labelled samples found")
+
+    with mp.Pool(max(1, args["processes"])) as pool:
+        # one hsv conversion per sample, summed into two histograms
+        tape = background = 0
+        for t, b in pool.imap_unordered(histograms, samples):
+            tape, background = tape + t, background + b
+        if not np.any(tape):
+            sys.exit("The masks do not label any tape")
+        tape, background = summed(tape), summed(background)
+
+        # start from the given bounds, the full range and random boxes
+        rng = np.random.default_rng(0)
+        starts = [from_bounds(args["lower"], args["upper"]), ((0, 0, 0), tuple(n - 1 for n in BINS))]
+        for _ in range(args["starts"]):
+            a, b = rng.integers(0, BINS, size=(2, 3))
+            starts.append((tuple(np.minimum(a, b)), tuple(np.maximum(a, b))))
+
+        # the best overlaps the starts settled on, each only once
+        descents = sorted(set(pool.imap_unordered(descend, [(tape, background) + start for start in starts])), reverse=True)
+
+        # rank them by detection, the overlap only breaks ties
+        ranked = []
+        for overlap, lo, hi in descents[:max(1, args["keep"])]:
+            candidate = to_bounds(lo, hi)
+            found, error = quality(pool.map(check, [(sample, candidate, config) for sample in samples]))
+            print("[INFO] bounds {} to {}: overlap {:.1%}, offset found in {:.1%} of labelled frames, mean error {:.3f} in".format(
+                candidate.lower, candidate.upper, overlap, found, error))
+            ranked.append(((found, -error, overlap), candidate))
+
+        bounds = max(ranked, key=lambda rank: rank[0])[1]
+        print("[INFO] best bounds {} to {}".format(bounds.lower, bounds.upper))
+
+    if args["roborio"]:
+        from networktables import NetworkTables
+
+        # the client connects in the background, wait for it or the bounds
+        # would be flushed into nothing
+        NetworkTables.initialize(server=args["roborio"])
+        deadline = time.monotonic() + args["connect"]
+        while not NetworkTables.isConnected():
+            if time.monotonic() >= deadline:
+                NetworkTables.shutdown()
+                sys.exit("Could not connect to {}, the bounds were not sent".format(args["roborio"]))
+            time.sleep(0.05)
+
+        sd = NetworkTables.getTable("SmartDashboard")
+        for (key, default), value in zip(LOWER_KEYS + UPPER_KEYS, bounds.lower + bounds.upper):
+            sd.putNumber(key, value)
+        NetworkTables.flush()
+        NetworkTables.shutdown()
+        print("[INFO] bounds sent to", args["roborio"])
+
+
+if __name__ == "__main__":
+    main()